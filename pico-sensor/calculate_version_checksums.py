@@ -1,10 +1,28 @@
 from immutable.checksum import calculate_checksum
 from json import load, dump
+from os.path import exists
+
+# precompressed web UI variants the pico can choose from, see STATIC_ENCODINGS in components/helpers.py
+VARIANT_SUFFIXES = [".br", ".gz"]
 
 
 with open("version.json") as f:
     version_config = load(f)
 
+# list the precompressed variants of web UI files the build produced next to the listed ones
+listed_files = [elem["repository"] for elem in version_config["files_included"]]
+for elem in list(version_config["files_included"]):
+    if "/dist/" not in elem["repository"]:
+        continue
+    repository_base, pico_base = elem["repository"], elem["pico"]
+    for suffix in VARIANT_SUFFIXES:
+        if repository_base.endswith(suffix):
+            repository_base, pico_base = repository_base[: -len(suffix)], pico_base[: -len(suffix)]
+    for suffix in VARIANT_SUFFIXES:
+        if repository_base + suffix not in listed_files and exists(repository_base + suffix):
+            version_config["files_included"].append({"repository": repository_base + suffix, "pico": pico_base + suffix})
+            listed_files.append(repository_base + suffix)
+
 checksummed_files_included = []
 
 for elem in version_config["files_included"]:
@@ -0,0 +1,159 @@
+import asyncio
+from json import dumps
+from typing import Any, Optional
+from components.sensors import Sensors, SensorHistory
+
+ALERT_OK = "ok"
+ALERT_LOW = "low"
+ALERT_HIGH = "high"
+DEFAULT_HYSTERESIS = 2.0
+DEFAULT_DEBOUNCE_SAMPLES = 2
+WEBHOOK_TIMEOUT_SECONDS = 5
+MAX_QUEUED_ALERTS = 8
+
+
+async def post_json(url: str, payload: Any) -> Optional[str]:
+    try:
+        scheme, _, host_port, path = (url + "/").split("/", 3)
+        port = 443 if scheme == "https:" else 80
+        host = host_port
+        if ":" in host_port:
+            host, port_str = host_port.split(":", 1)
+            port = int(port_str)
+        reader, writer = await asyncio.open_connection(host, port, ssl=scheme == "https:")
+        body = dumps(payload).encode()
+        request = "POST /{} HTTP/1.0\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+            path.rstrip("/"), host, len(body)
+        )
+        try:
+            writer.write(request.encode() + body)
+            await writer.drain()
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        status = status_line.split(b" ")
+        if len(status) < 2 or not status[1].startswith(b"2"):
+            return f"webhook {url} answered: {status_line}"
+    except Exception as e:
+        return f"webhook {url} failed: {str(e)}"
+    return None
+
+
+class ThresholdAlert:
+    # Per-sensor alert state, updated in O(1) for every new sample.
+    # A state change needs `debounce` consecutive samples agreeing with it, and
+    # leaving low/high needs the value to get `hysteresis` units back inside the limits.
+
+    def __init__(
+        self,
+        index: int,
+        name: str,
+        min_value: float,
+        max_value: float,
+        hysteresis: float,
+        debounce: int,
+    ) -> None:
+        self.index = index
+        self.name = name
+        self.min_value = min_value
+        self.max_value = max_value
+        self.hysteresis = hysteresis
+        self.debounce = max(1, debounce)
+        self.state = ALERT_OK
+        self.since: Optional[int] = None
+        self.value: Optional[float] = None
+        self.pending_state = ALERT_OK
+        self.pending_count = 0
+
+    def _classify(self, value: float) -> str:
+        if value < self.min_value:
+            return ALERT_LOW
+        if value > self.max_value:
+            return ALERT_HIGH
+        if self.state == ALERT_LOW and value < self.min_value + self.hysteresis:
+            return ALERT_LOW
+        if self.state == ALERT_HIGH and value > self.max_value - self.hysteresis:
+            return ALERT_HIGH
+        return ALERT_OK
+
+    def evaluate(self, value: float, event_unix_time: int) -> bool:
+        # returns True when the alert state changed
+        self.value = value
+        candidate = self._classify(value)
+        if candidate == self.state:
+            self.pending_count = 0
+            return False
+        if candidate == self.pending_state:
+            self.pending_count += 1
+        else:
+            self.pending_state = candidate
+            self.pending_count = 1
+        if self.pending_count < self.debounce:
+            return False
+        self.state = candidate
+        self.since = event_unix_time
+        self.pending_count = 0
+        return True
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "index": self.index,
+            "name": self.name,
+            "state": self.state,
+            "since": self.since,
+            "value": self.value,
+            "min": self.min_value,
+            "max": self.max_value,
+        }
+
+
+class AlertEngine:
+    def __init__(self, sensors: Sensors, config: dict[str, Any]) -> None:
+        self.webhook_url: Optional[str] = config.get("alert_webhook")
+        self.alerts: list[ThresholdAlert] = []
+        # state changes are posted by run() so a slow webhook never holds up sampling or the web server
+        self.outbox: list[dict[str, Any]] = []
+        self.outbox_ready = asyncio.Event()
+        for index, configured_sensor in enumerate(config.get("sensors")):
+            alert = ThresholdAlert(
+                index=index,
+                name=configured_sensor.get("name"),
+                min_value=configured_sensor.get("min", 0),
+                max_value=configured_sensor.get("max", 100),
+                hysteresis=configured_sensor.get("hysteresis", DEFAULT_HYSTERESIS),
+                debounce=configured_sensor.get("debounce", DEFAULT_DEBOUNCE_SAMPLES),
+            )
+            # seed the state from the newest samples so a reboot does not reset active alerts
+            for value, event_unix_time in sensors.get_sensor(index=index).get_data()[-alert.debounce:]:
+                alert.evaluate(value, event_unix_time)
+            self.alerts.append(alert)
+        sensors.add_listener(self._on_sample)
+
+    def _on_sample(self, history: SensorHistory, value: float, event_unix_time: int) -> None:
+        alert = self.alerts[history.index]
+        if alert.evaluate(value, event_unix_time) and self.webhook_url:
+            if len(self.outbox) >= MAX_QUEUED_ALERTS:
+                self.outbox.pop(0)
+            self.outbox.append(alert.to_dict())
+            self.outbox_ready.set()
+
+    async def run(self) -> None:
+        # failed posts are logged and dropped, the next state change is sent as usual
+        while self.webhook_url:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            while self.outbox:
+                payload = self.outbox.pop(0)
+                try:
+                    err = await asyncio.wait_for(post_json(self.webhook_url, payload), WEBHOOK_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    err = f"webhook {self.webhook_url} timed out"
+                if err:
+                    print(err)
+
+    def rename(self, index: int, name: str) -> None:
+        self.alerts[index].name = name
+
+    def states(self) -> list[dict[str, Any]]:
+        return [alert.to_dict() for alert in self.alerts]
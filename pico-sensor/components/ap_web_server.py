@@ -7,20 +7,22 @@ from gc import collect
 from components.status_led import StatusLed
 
 WIFI_CONFIG_FILE = "wifi_config.json"
+AP_PAGE_FILE = "ap_index.html"
 s = None
 conn = None
+ap_page = None  # the setup page as a ready-to-send response, read from flash once
 
-def stream_file(path: str, client: Any, content_type: str) -> None:
-    try:
-        with open(path, "r") as file:
-            client.send(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n\r\n")
-            while True:
-                chunk = file.read(1024)  # Read file in chunks of 1024 bytes
-                if not chunk:
-                    break
-                client.send(chunk)
-    except:
-        client.send("HTTP/1.1 404 Not Found\r\n\r\n")
+def send_ap_page(client: Any) -> None:
+    global ap_page
+    if ap_page is None:
+        try:
+            with open(AP_PAGE_FILE, "rb") as file:
+                body = file.read()
+        except OSError:
+            client.send("HTTP/1.1 404 Not Found\r\n\r\n")
+            return
+        ap_page = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    client.send(ap_page)
 
 def save_wifi_config(ssid: str, password: str) -> None:
     wifi_config = {"ssid": ssid, "password": password}
@@ -39,11 +41,10 @@ def handle_request_ap_mode(conn: Any, status_led: StatusLed) -> None:
             ssid = ssid.replace("+", " ")
             password = password.replace("'", "")
             save_wifi_config(ssid, password)
-            conn.send("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n")
-            conn.send(dumps({"status": "ok"}))
+            conn.send("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" + dumps({"status": "ok"}))
             status_led.signal_wifi_set()
             reset()
-    stream_file("ap_index.html", conn, "text/html")
+    send_ap_page(conn)
     conn.close()
 
 def start_ap_web_server(status_led: StatusLed) -> None:
@@ -7,13 +7,16 @@ from machine import Pin, reset, freq  # type: ignore
 from components.wifi_reset_button import WifiResetButton
 from components.network_connection import NetworkConnection
 from components.web_real_time_clock import WebRealTimeClock
-from components.cloud_updater import check_for_updates, download_update, get_download_status
+from components.cloud_updater import check_for_updates, update_job, UPDATE_READY
 from components.sensors import Sensors, save_config
-from components.helpers import get_flash_sizes, CHUNK_SIZE, CONFIG_FILE
-from components.microdot import Microdot, Response, Request
+from components.alerts import AlertEngine
+from components.rate_limit import RateLimiter
+from components.helpers import get_flash_sizes, get_chunk_size, load_static_etags, accepted_encodings, STATIC_ENCODINGS, CONFIG_FILE, RESPONSE_CACHE_BYTES, STATIC_CACHE_BYTES, STATIC_CACHE_MAX_FILE_BYTES, READ_NOW_MAX_AGE_SECONDS, REQUEST_HEADERS, MIN_FREE_MEMORY, FIRMWARE_DOWNLOAD_TIMEOUT_SECONDS, RATE_LIMIT_TOKENS_PER_SECOND, RATE_LIMIT_BURST, RATE_LIMIT_COSTS
+from components.microdot import Microdot, Response, Request, ResponseCache
 from time import sleep
 from json import dumps, load
-from typing import Tuple, Optional, Union
+import asyncio
+from typing import Tuple, Union
 from gc import collect
 
 
@@ -36,7 +39,31 @@ while True:
     sleep(5)
 rtc = WebRealTimeClock()
 sensors = Sensors(rtc=rtc)
+with open(CONFIG_FILE, "r") as f:
+    config = load(f)
+alerts = AlertEngine(sensors=sensors, config=config)
+read_now_max_age_ms = config.get("read_now_max_age_seconds", READ_NOW_MAX_AGE_SECONDS) * 1000
+del config
 app = Microdot()  # type: ignore
+app.response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_BYTES)
+Request.header_allow_list = REQUEST_HEADERS
+app.min_free_memory = MIN_FREE_MEMORY
+rate_limiter = RateLimiter(rate=RATE_LIMIT_TOKENS_PER_SECOND, burst=RATE_LIMIT_BURST, costs=RATE_LIMIT_COSTS)
+app.before_request(rate_limiter.check)
+static_etags, err = load_static_etags()
+if err:
+    print(err)
+# small web UI files only change when a new version is installed at boot
+static_cache = ResponseCache(max_bytes=STATIC_CACHE_BYTES)
+STATIC_CONTENT_TYPES = {
+    "html": "text/html",
+    "js": "application/javascript",
+    "css": "text/css",
+    "ico": "image/x-icon",
+    "svg": "image/svg+xml",
+}
+collect()
+Response.send_file_buffer_size = get_chunk_size()
 
 
 def internal_error(err: str) -> Tuple[str, int]:
@@ -46,12 +73,11 @@ def internal_error(err: str) -> Tuple[str, int]:
 
 
 @app.route("/")  # type: ignore
-def index(request: Request) -> Tuple[str, int, dict[str, str]]:
-    with open("/dist/index.html") as f:
-        return f.read(), 200, {"Content-Type": "text/html"}
+def index(request: Request) -> Response:
+    return static(request, "index.html")  # type: ignore
 
 
-@app.route("/api/v1/health", methods=["GET"])
+@app.route("/api/v1/health", methods=["GET"], cache=True, inline=True)
 def get_health(request: Request) -> Tuple[str, int]:
     return dumps({
         "ok": True
@@ -59,7 +85,7 @@ def get_health(request: Request) -> Tuple[str, int]:
     }), 200
 
 
-@app.route("/api/v1/sensor_meta", methods=["GET"])  # type: ignore
+@app.route("/api/v1/sensor_meta", methods=["GET"], cache=True)  # type: ignore
 def get_meta(request: Request) -> Tuple[str, int]:
     with open(CONFIG_FILE, "r") as f:
         sensor_meta = load(f)["sensors"]
@@ -67,37 +93,42 @@ def get_meta(request: Request) -> Tuple[str, int]:
 
 
 @app.route("/api/v1/sensor_data", methods=["GET"])  # type: ignore
-def get_data(request: Request) -> Tuple[str, int]:
+def get_data(request: Request) -> Response:
     sensor_index = int(request.args.get("sensor_index", 0))
     sensor_monitor = sensors.get_sensor(index=sensor_index)
-    try:
-        name = sensor_monitor.sensor.name  # type: ignore
-    except:
-        name = sensor_monitor.history.sensor_type
-    sensor_data = sensor_monitor.get_data()
-    sensor = sensor_monitor.get_sensor()
-    values = []
-    times = []
-    for elem in sensor_data:
-        if elem[1] < 1282542159:
-            continue
-        try:
-            values.append(elem[0])
-            times.append(elem[1])
-        except:
-            pass
-
-    min, max = sensor.limits()
-    response_data = {
+    return serve_file(request, sensor_monitor.history.payload_file, "application/json")
+
+
+@app.route("/api/v1/read_now", methods=["GET"], coalesce=True)  # type: ignore
+async def get_read_now(request: Request) -> Tuple[str, int]:
+    sensor_index = int(request.args.get("sensor_index", 0))
+    sensor_monitor = sensors.get_sensor(index=sensor_index)
+    value = await sensor_monitor.read(max_age_ms=read_now_max_age_ms)
+    return dumps({
         "index": sensor_index,
-        "name": name,
-        "type": sensor_monitor.history.sensor_type,
-        "times": times,
-        "values": values,
-        "min": min,
-        "max": max,
-    }
-    return dumps(response_data), 200
+        "name": sensor_monitor.history.name,
+        "value": value,
+        "time": rtc.get_current_unix_time() - sensor_monitor.sensor.age_ms() // 1000,
+    }), 200
+
+
+@app.route("/api/v1/forecast", methods=["GET"], inline=True)  # type: ignore
+def get_forecast(request: Request) -> Tuple[str, int]:
+    forecasts = []
+    for index in range(len(sensors.sensor_monitors_by_index)):
+        history = sensors.get_sensor(index=index).history
+        if history.trend:
+            forecast = history.trend.to_dict()
+            forecast.update({"index": index, "name": history.name})
+            forecasts.append(forecast)
+    return dumps(forecasts), 200
+
+
+@app.route("/api/v1/sparkline.svg", methods=["GET"])  # type: ignore
+def get_sparkline(request: Request) -> Response:
+    sensor_index = int(request.args.get("sensor_index", 0))
+    sensor_monitor = sensors.get_sensor(index=sensor_index)
+    return serve_file(request, sensor_monitor.history.sparkline_file, "image/svg+xml")
 
 
 @app.route("/api/v1/sensor_name", methods=["POST"])  # type: ignore
@@ -111,11 +142,18 @@ def set_meta(request: Request) -> Tuple[str, int]:
         config["sensors"][sensor_index]["name"] = given_name
     save_config(updated_config=config)
     sensor_monitor = sensors.get_sensor(index=sensor_index)
-    sensor_monitor.sensor.name = given_name  # type: ignore
+    sensor_monitor.rename(given_name)
+    alerts.rename(index=sensor_index, name=given_name)
+    app.response_cache.invalidate("/api/v1/sensor_meta")
     return dumps({"name": given_name}), 200
 
 
-@app.route("/api/v1/led", methods=["GET"])  # type: ignore
+@app.route("/api/v1/alerts", methods=["GET"], inline=True)  # type: ignore
+def get_alerts(request: Request) -> Tuple[str, int]:
+    return dumps(alerts.states()), 200
+
+
+@app.route("/api/v1/led", methods=["GET"], cache=True, inline=True)  # type: ignore
 def get_led(request: Request) -> Tuple[str, int]:
     return dumps({"value": int(status_led.lit)}), 200
 
@@ -128,12 +166,13 @@ def set_led(request: Request) -> Tuple[str, int]:
         status_led.disco_stop()
     elif value == 1:
         status_led.disco_start()
+    app.response_cache.invalidate("/api/v1/led")
     return dumps({"led": status_led.lit}), 200
 
 
 @app.route("/api/v1/updates_available", methods=["GET"])  # type: ignore
-def get_updates_availalbe(request: Request) -> Tuple[str, int]:
-    current_version, remote_version, updates_available, err = check_for_updates()
+async def get_updates_availalbe(request: Request) -> Tuple[str, int]:
+    current_version, remote_version, updates_available, err = await check_for_updates()
     if err:
         return internal_error(err=err)
     return (
@@ -160,66 +199,106 @@ def post_reset(request: Request):
 
 
 @app.route("/api/v1/download_firmware", methods=["POST"])  # type: ignore
-def post_update_firmware(request: Request) -> Tuple[str, int]:
+async def post_update_firmware(request: Request) -> Tuple[str, int]:
+    # with ?background=1 the download is only started, clients then poll /api/v1/update_status,
+    # without it the request waits for the download to finish as older web UIs expect
     force_update = request.args.get("force", 0)
-    _, _, updates_available, err = check_for_updates()
-    if err:
-        return dumps({"error": err}), 500
-    if updates_available or force_update:
-        err = download_update()
-        if err:
-            return internal_error(err=err)
-        err = get_download_status()
+    background = request.args.get("background", 0)
+    if not update_job.running():
+        _, _, updates_available, err = await check_for_updates()
         if err:
-            return internal_error(err=err)
-        return dumps({
-            "ready": True
-        }), 200
-    return dumps({"error": "no updates available"}), 400
+            return dumps({"error": err}), 500
+        if not (updates_available or force_update):
+            return dumps({"error": "no updates available"}), 400
+        update_job.start()
+    if background:
+        return dumps(update_job.to_dict()), 202
+    # downloading all files takes minutes, far longer than a request is normally given
+    app.set_deadline(FIRMWARE_DOWNLOAD_TIMEOUT_SECONDS)
+    await update_job.done.wait()
+    if update_job.error:
+        return internal_error(err=update_job.error)
+    return dumps({
+        "ready": update_job.state == UPDATE_READY
+    }), 200
+
+
+@app.route("/api/v1/update_status", methods=["GET"], inline=True)  # type: ignore
+def get_update_status(request: Request) -> Tuple[str, int]:
+    return dumps(update_job.to_dict()), 200
+
+
+@app.route("/api/v1/cancel_update", methods=["POST"])  # type: ignore
+def post_cancel_update(request: Request) -> Tuple[str, int]:
+    if not update_job.cancel():
+        return dumps({"error": "no update running"}), 400
+    return dumps(update_job.to_dict()), 200
 
 
 @app.route("/<path:path>")  # type: ignore
-def static(request: Request, path: str) -> Optional[Union[Tuple[str, int], Response]]:
-    if "api/v1" in request.url:
-        return None
-    accept_encoding = request.headers.get("Accept-Encoding", "")
+def static(request: Request, path: str) -> Union[Tuple[str, int], Response]:
+    if path.startswith("api/"):
+        return dumps({"error": "not found"}), 404
     path = f"/dist/{path}"
-    if path.endswith(".js"):
-        if "gzip" in accept_encoding:
-            return serve_file(f"{path}.gz", "application/javascript", "gzip")
-        else:
-            return dumps({"error": "gzip not supported on browser"}), 400
-    elif path.endswith(".css"):
-        return serve_file(f"{path}.gz", "text/css", "gzip")
-    elif path.endswith(".html"):
-        return serve_file(path, "text/html")
-    elif path.endswith(".ico"):
-        return serve_file(path, "image/x-icon")
-    return serve_file(path, "application/octet-stream")
-
-
-def serve_file(file_path: str, content_type: str, encoding: str = "") -> Response:
-    def file_stream():  # type: ignore
-        try:
-            with open(file_path, "rb") as f:
-                while True:
-                    chunk = f.read(CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    yield chunk
-        except OSError as e:
-            print(f"File not found: {file_path}")
-            raise e
-
+    content_type = STATIC_CONTENT_TYPES.get(path.rsplit(".", 1)[-1], "application/octet-stream")
+    # version.json tells which variants are on flash, so negotiating needs no filesystem lookups
+    variants = [(encoding, suffix) for encoding, suffix in STATIC_ENCODINGS if path + suffix in static_etags]
+    if not variants:
+        return serve_file(request, path, content_type)
+    accepted = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    encoding, suffix = variants[-1]
+    for variant in variants:
+        if not variant[0] or variant[0] in accepted:
+            encoding, suffix = variant
+            break
+    response = serve_file(request, path + suffix, content_type, encoding)
+    if len(variants) > 1 or encoding:
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def serve_file(request: Request, file_path: str, content_type: str, encoding: str = "") -> Response:
     headers = {"Content-Type": content_type}
     if encoding:
         headers["Content-Encoding"] = encoding
-    return Response(body=file_stream(), headers=headers)  # type: ignore
+    if file_path.startswith("/dist/assets/"):
+        # bundle file names carry a content hash, a new build gets new names
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    elif file_path in static_etags:
+        headers["Cache-Control"] = "no-cache"
+        headers["ETag"] = static_etags[file_path]
+        if headers["ETag"] in request.headers.get("If-None-Match", ""):
+            # only validators and caching headers, the client already has the representation
+            return Response(b"", 304, {"Cache-Control": "no-cache", "ETag": headers["ETag"]}, reason="Not Modified")  # type: ignore
+        cached = static_cache.get(file_path)
+        if cached:
+            return Response(cached[2], 200, dict(cached[1]))  # type: ignore
+
+    try:
+        f = open(file_path, "rb")
+    except OSError:
+        print(f"File not found: {file_path}")
+        return Response(dumps({"error": "not found"}), 404)
+    if file_path in static_etags and f.seek(0, 2) <= STATIC_CACHE_MAX_FILE_BYTES:
+        f.seek(0)
+        body = f.read()
+        f.close()
+        static_cache.put(file_path, 200, headers, body)
+        return Response(body, 200, dict(headers))  # type: ignore
+    f.seek(0)
+    return Response(body=f, headers=headers)  # type: ignore
+
+
+async def main() -> None:
+    # sensors are sampled by a task on the same loop as the web server, not from timer callbacks
+    asyncio.create_task(sensors.scheduler.run())
+    asyncio.create_task(alerts.run())
+    await app.start_server(host="0.0.0.0", port=80)  # type: ignore
 
 
 print("all set")
 try:
-    app.run(host="0.0.0.0", port=80)  # type: ignore
+    asyncio.run(main())
 except Exception as e:
     print("Exception in app.run", e)
     raise e
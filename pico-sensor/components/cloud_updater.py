@@ -1,16 +1,15 @@
+import asyncio
 from gc import collect
 from os import listdir, remove, rmdir, mkdir
 import os
 from machine import Timer, reset  # type: ignore
-from time import sleep
-import socket, ssl
+from hashlib import sha256
 from json import load, dump
-from components.helpers import file_exists, load_json
+from components.helpers import file_exists, load_json, CHUNK_SIZE
 from components.status_led import StatusLed
-from typing import Any, Tuple
-from immutable.checksum import calculate_checksum
+from typing import Any, Optional, Tuple
+from immutable.checksum import to_hex
 from components.flasher import (
-    validate_new_version,
     delete_directory_recursively,
     NEW_VERSION_DIR,
 )
@@ -18,6 +17,24 @@ from components.flasher import (
 BRANCH: str = "main"
 BASE_URL: str = f"https://raw.githubusercontent.com/snuarrow/LaiskaJaakko/{BRANCH}/pico-sensor/"
 VERSION_JSON: str = "version.json"
+DOWNLOAD_RETRIES: int = 5
+DOWNLOAD_RETRY_DELAY_SECONDS: int = 3
+DOWNLOAD_READ_SIZE: int = 4096
+REMOTE_VERSION_JSON: str = "remote-version.json"
+REMOTE_VERSION_DOWNLOAD: str = "remote-version.json.tmp"
+
+UPDATE_IDLE: str = "idle"
+UPDATE_QUEUED: str = "queued"
+UPDATE_DOWNLOADING: str = "downloading"
+UPDATE_VERIFYING: str = "verifying"
+UPDATE_READY: str = "ready"
+UPDATE_FAILED: str = "failed"
+UPDATE_CANCELLED: str = "cancelled"
+
+# Everything here runs on the web server's event loop, so network reads, file writes and
+# checksums all yield between chunks to keep the other clients served during an update.
+
+version_check_lock = asyncio.Lock()
 
 
 def _load_file(filename: str) -> Any:
@@ -26,10 +43,7 @@ def _load_file(filename: str) -> Any:
         return version_config
 
 
-def _download_files(files_missing: list[str]) -> None:
-    remote_version_config, err = load_json("remote-version.json")
-    if err:
-        raise Exception("Failed to load remote-version.json")
+async def _download_files(remote_version_config: dict[str, Any], files_missing: list[str], job: Optional["UpdateJob"] = None) -> None:
     try:
         delete_directory_recursively("old_version")
     except:
@@ -44,71 +58,83 @@ def _download_files(files_missing: list[str]) -> None:
             mkdir(new_directory)
         except:
             pass
-    for elem in files_missing:
-        for i in range(5):
+    for index, elem in enumerate(files_missing):
+        if job:
+            job.start_file(index=index, total=len(files_missing), name=str(elem["pico"]))  # type: ignore
+        for i in range(DOWNLOAD_RETRIES):
             try:
                 remote_file_name: str = str(elem["repository"])  # type: ignore
                 relative_local_file_name: str = str(elem["pico"])  # type: ignore
-                _download_file(
+                await _download_file(
                     remote_file_name=remote_file_name,
                     local_file_name=NEW_VERSION_DIR + "/" + relative_local_file_name,
+                    job=job,
                 )
                 break
             except Exception as e:
-                if i == 4:
+                if i == DOWNLOAD_RETRIES - 1:
                     raise (e)
-                sleep(3)
-                pass
+                await asyncio.sleep(DOWNLOAD_RETRY_DELAY_SECONDS)
     collect()
 
 
-def _download_file(remote_file_name: str, local_file_name: str) -> None:
+async def _download_file(remote_file_name: str, local_file_name: str, job: Optional["UpdateJob"] = None) -> None:
     collect()
     https_file_url = f"{BASE_URL}{remote_file_name}?raw=True"
     _, _, host, path = https_file_url.split("/", 3)
     print(f"<- {https_file_url} as {local_file_name}")
     path = "/" + path
-    addr = socket.getaddrinfo(host, 443)[0][-1]
-    collect()
-    http_socket = socket.socket()
-    http_socket.connect(addr)
-    collect()
-    ssl_socket = ssl.wrap_socket(http_socket, server_hostname=host)  # type: ignore
-    request = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
-        path, host
-    )
-    ssl_socket.write(request.encode("utf-8"))
-    response = b""
-    while b"\r\n\r\n" not in response:
-        response += ssl_socket.read(1)
-    header, body = response.split(b"\r\n\r\n", 1)
-    with open(local_file_name, "wb") as file:
-        file.write(body)
-        collect()
+    reader, writer = await asyncio.open_connection(host, 443, ssl=True)
+    try:
+        request = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
+            path, host
+        )
+        writer.write(request.encode("utf-8"))
+        await writer.drain()
+        status_line = await reader.readline()
+        status = status_line.split(b" ")
+        if len(status) < 2 or status[1] != b"200":
+            raise Exception(f"{remote_file_name} answered: {status_line}")
+        content_length = 0
         while True:
-            for i in range(10):  # retry 10 mem alloc times
-                try:
-                    data = ssl_socket.read(4096)
-                    break
-                except Exception as e:
-                    if i == 9:
-                        ssl_socket.close()
-                        http_socket.close()
-                        del ssl_socket
-                        del http_socket
-                        collect()
-                    pass
-            if not data:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
                 break
-            file.write(data)
-    ssl_socket.close()
-    http_socket.close()
-    del ssl_socket
-    del http_socket
-    collect()
+            if line.lower().startswith(b"content-length:"):
+                content_length = int(line[15:].strip())
+        if job:
+            job.start_bytes(total=content_length)
+        collect()
+        with open(local_file_name, "wb") as file:
+            while True:
+                data = await reader.read(DOWNLOAD_READ_SIZE)
+                if not data:
+                    break
+                file.write(data)
+                if job:
+                    job.add_bytes(len(data))
+    finally:
+        writer.close()
+        await writer.wait_closed()
+        collect()
 
 
-def validate_files(remote_config_files: list[str]) -> list[str]:
+async def _calculate_checksum(file_path: str) -> str | None:
+    checksum = sha256()
+    try:
+        with open(file_path, "rb") as file:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                checksum.update(chunk)
+                await asyncio.sleep(0)
+    except OSError:
+        return None
+    return to_hex(checksum.digest())
+
+
+async def validate_files(remote_config_files: list[str]) -> list[str]:
     invalid_files = []
     folder = f"{NEW_VERSION_DIR}/"
     for elem in remote_config_files:
@@ -118,7 +144,7 @@ def validate_files(remote_config_files: list[str]) -> list[str]:
             invalid_files.append(elem)
             continue
         expected_checksum = elem["check"]  # type: ignore
-        actual_checksum = calculate_checksum(filename)
+        actual_checksum = await _calculate_checksum(filename)
 
         if expected_checksum != actual_checksum:
             invalid_files.append(elem)
@@ -127,17 +153,26 @@ def validate_files(remote_config_files: list[str]) -> list[str]:
     return invalid_files
 
 
-def check_for_updates() -> Tuple[int, int, bool, str | None]:
+async def check_for_updates() -> Tuple[int, int, bool, str | None]:
     print("checking for updates..")
     version_config, err = load_json(filename=VERSION_JSON)
     if err:
         return 0, 0, False, err
     current_version = int(version_config["version"])
-    try:
-        _download_file("version.json", "remote-version.json")
-    except Exception as e:
-        return 0, 0, False, f"Failed to download version.json: {str(e)}"
-    remote_version_config, err = load_json(filename="remote-version.json")
+    # a running or finished download keeps the remote version it was started with,
+    # and the new file is renamed into place so readers never see it half written
+    async with version_check_lock:
+        if not (update_job.running() or update_job.state == UPDATE_READY):
+            try:
+                await _download_file("version.json", REMOTE_VERSION_DOWNLOAD)
+                try:
+                    remove(REMOTE_VERSION_JSON)
+                except OSError:
+                    pass
+                os.rename(REMOTE_VERSION_DOWNLOAD, REMOTE_VERSION_JSON)
+            except Exception as e:
+                return 0, 0, False, f"Failed to download version.json: {str(e)}"
+    remote_version_config, err = load_json(filename=REMOTE_VERSION_JSON)
     if err:
         return 0, 0, False, err
     remote_version: int = remote_version_config["version"]
@@ -145,21 +180,18 @@ def check_for_updates() -> Tuple[int, int, bool, str | None]:
     return current_version, remote_version, updates_available, None
 
 
-def download_update() -> None | str:
-    remote_version_config, err = load_json(filename="remote-version.json")
-    if err:
-        return f"Failed to load remote-version.json"
-    files_missing = validate_files(remote_version_config["files_included"])
+async def download_update(remote_version_config: dict[str, Any], job: Optional["UpdateJob"] = None) -> None | str:
+    files_missing = await validate_files(remote_version_config["files_included"])
     try:
-        _download_files(files_missing)
+        await _download_files(remote_version_config, files_missing, job=job)
     except Exception as e:
         return f"Failed to update: {str(e)}"
 
 
-def get_download_status() -> str | None:
-    err = validate_new_version()
-    if err:
-        return err
+async def get_download_status(remote_version_config: dict[str, Any]) -> str | None:
+    invalid_files = await validate_files(remote_version_config["files_included"])
+    if invalid_files:
+        return f"Error: Checksum mismatch in new file: {invalid_files[0]['pico']}"  # type: ignore
     with open("update.json", "w") as f:
         dump(
             {
@@ -169,3 +201,97 @@ def get_download_status() -> str | None:
             f,
         )
     return None
+
+
+class UpdateJob:
+    # Downloads a new version in the background: queued -> downloading -> verifying -> ready,
+    # or failed / cancelled. Progress is kept as plain counters for polling clients.
+
+    def __init__(self) -> None:
+        self.state = UPDATE_IDLE
+        self.error: Optional[str] = None
+        self.task: Any = None
+        self.done = asyncio.Event()
+        self._reset_progress()
+
+    def _reset_progress(self) -> None:
+        self.file_index = 0
+        self.file_count = 0
+        self.file_name: Optional[str] = None
+        self.file_bytes = 0
+        self.file_bytes_total = 0
+        self.bytes_downloaded = 0
+
+    def running(self) -> bool:
+        return self.state in (UPDATE_QUEUED, UPDATE_DOWNLOADING, UPDATE_VERIFYING)
+
+    def start(self) -> bool:
+        # returns False when a job is already running
+        if self.running():
+            return False
+        self.state = UPDATE_QUEUED
+        self.error = None
+        self._reset_progress()
+        self.done = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+        return True
+
+    def cancel(self) -> bool:
+        if not self.running():
+            return False
+        self.task.cancel()
+        return True
+
+    async def _run(self) -> None:
+        try:
+            self.state = UPDATE_DOWNLOADING
+            # loaded once, so the download and the verification use the same file list
+            remote_version_config, err = load_json(filename=REMOTE_VERSION_JSON)
+            if not err:
+                err = await download_update(remote_version_config, job=self)
+            if not err:
+                self.state = UPDATE_VERIFYING
+                err = await get_download_status(remote_version_config)
+            self.error = err
+            self.state = UPDATE_FAILED if err else UPDATE_READY
+        except asyncio.CancelledError:
+            self.state = UPDATE_CANCELLED
+        except Exception as e:
+            self.error = f"Failed to update: {str(e)}"
+            self.state = UPDATE_FAILED
+        finally:
+            self.task = None
+            self.done.set()
+            collect()
+
+    def start_file(self, index: int, total: int, name: str) -> None:
+        self.file_index = index
+        self.file_count = total
+        self.file_name = name
+        self.file_bytes = 0
+        self.file_bytes_total = 0
+
+    def start_bytes(self, total: int) -> None:
+        # a retried download starts the file over
+        self.bytes_downloaded -= self.file_bytes
+        self.file_bytes = 0
+        self.file_bytes_total = total
+
+    def add_bytes(self, count: int) -> None:
+        self.file_bytes += count
+        self.bytes_downloaded += count
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "file": self.file_index + 1 if self.file_count else 0,
+            "files": self.file_count,
+            "fileName": self.file_name,
+            "fileBytes": self.file_bytes,
+            "fileBytesTotal": self.file_bytes_total,
+            "bytesDownloaded": self.bytes_downloaded,
+        }
+
+
+update_job = UpdateJob()
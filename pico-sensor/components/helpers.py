@@ -5,7 +5,35 @@ from typing import Tuple
 
 
 CHUNK_SIZE = 1024
+LARGE_CHUNK_SIZE = 4096
+LARGE_CHUNK_MIN_FREE_MEMORY = 96 * 1024
 CONFIG_FILE = "config.json"
+VERSION_FILE = "version.json"
+STATIC_DIR = "dist/"
+# precompressed variants of web UI files, in order of preference
+STATIC_ENCODINGS = (("br", ".br"), ("gzip", ".gz"), ("", ""))
+RESPONSE_CACHE_BYTES = 12 * 1024
+STATIC_CACHE_BYTES = 4 * 1024
+STATIC_CACHE_MAX_FILE_BYTES = 2 * 1024
+# below this much free heap new requests get 503 instead of risking MemoryError
+MIN_FREE_MEMORY = 16 * 1024
+# request headers the firmware reads, all others are dropped while parsing
+REQUEST_HEADERS = {"content-type", "connection", "accept-encoding", "range", "if-range", "if-none-match"}
+READ_NOW_MAX_AGE_SECONDS = 60
+FIRMWARE_DOWNLOAD_TIMEOUT_SECONDS = 15 * 60
+# per client token bucket: a dashboard load fetches every sensor's history at once,
+# a client polling in a loop is held to the refill rate
+RATE_LIMIT_TOKENS_PER_SECOND = 3
+RATE_LIMIT_BURST = 60
+RATE_LIMIT_COSTS = {
+    "/api/v1/health": 0.5,
+    "/api/v1/sensor_data": 4,
+    "/api/v1/read_now": 3,
+    "/api/v1/forecast": 2,
+    "/api/v1/sparkline.svg": 2,
+    "/api/v1/updates_available": 10,
+    "/api/v1/download_firmware": 10,
+}
 
 
 def get_flash_sizes() -> Tuple[int, int]:
@@ -17,6 +45,11 @@ def get_flash_sizes() -> Tuple[int, int]:
     return int(total_flash_kb), int(free_flash_kb)
 
 
+def get_chunk_size() -> int:
+    # larger chunks mean fewer writes per file, but only while the heap can spare them
+    return LARGE_CHUNK_SIZE if mem_free() > LARGE_CHUNK_MIN_FREE_MEMORY else CHUNK_SIZE
+
+
 def print_memory_usage() -> None:
     total_memory = mem_alloc() + mem_free()
     used_memory = mem_alloc()
@@ -41,3 +74,27 @@ def load_json(filename: str) -> Tuple[Any, str | None]:
             return version_config, None
     except Exception as e:
         return None, f"error reading json file: {filename}, exception: {str(e)}"
+
+
+def load_static_etags() -> Tuple[dict[str, str], str | None]:
+    # web UI files keyed by their absolute path on the pico, tagged with their version.json checksum
+    version_config, err = load_json(filename=VERSION_FILE)
+    if err:
+        return {}, err
+    etags = {}
+    for file_included in version_config["files_included"]:
+        if file_included["pico"].startswith(STATIC_DIR):
+            etags["/" + file_included["pico"]] = f'"{file_included["check"][:16]}"'
+    return etags, None
+
+
+def accepted_encodings(accept_encoding: str) -> list[str]:
+    # content codings from an Accept-Encoding header, leaving out the ones refused with q=0
+    encodings = []
+    for token in accept_encoding.split(","):
+        name, _, params = token.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=0") and params.strip("q=0.") == "":
+            continue
+        encodings.append(name.strip().lower())
+    return encodings
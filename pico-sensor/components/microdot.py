@@ -19,12 +19,22 @@ try:
 
         This method runs sync handlers in a thread pool executor.
         """
+        return await _invoke_handler(handler, False, None, *args, **kwargs)
+
+    async def _invoke_handler(handler, inline, executor, *args, **kwargs):
         if iscoroutinefunction(handler):
             ret = await handler(*args, **kwargs)
+        elif inline:
+            ret = handler(*args, **kwargs)
         else:
             ret = await asyncio.get_running_loop().run_in_executor(
-                None, partial(handler, *args, **kwargs))
+                executor, partial(handler, *args, **kwargs))
         return ret
+
+    def _create_executor(max_workers):
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=max_workers,
+                                  thread_name_prefix='microdot')
 except ImportError:  # pragma: no cover
     def iscoroutine(coro):
         return hasattr(coro, 'send') and hasattr(coro, 'throw')
@@ -40,6 +50,31 @@ except ImportError:  # pragma: no cover
             ret = await ret
         return ret
 
+    async def _invoke_handler(handler, inline, executor, *args, **kwargs):
+        # there are no threads, every handler already runs inline
+        return await invoke_handler(handler, *args, **kwargs)
+
+    def _create_executor(max_workers):
+        return None
+
+try:
+    from time import ticks_ms, ticks_add, ticks_diff
+except ImportError:  # pragma: no cover
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+try:
+    from gc import collect, mem_free
+except ImportError:  # pragma: no cover
+    # CPython has no heap figure to go by, so memory shedding is disabled
+    mem_free = None
+
 try:
     from sys import print_exception
 except ImportError:  # pragma: no cover
@@ -325,6 +360,15 @@ class Request:
     #:    Request.max_readline = 16 * 1024  # 16KB lines allowed
     max_readline = 2 * 1024
 
+    #: Lowercase names of the request headers to keep. Other headers are
+    #: read and dropped without being decoded. ``Content-Length`` is always
+    #: honored. Set to ``None`` to keep all headers.
+    #:
+    #: Example::
+    #:
+    #:    Request.header_allow_list = {'content-type', 'connection'}
+    header_allow_list = None
+
     class G:
         pass
 
@@ -342,9 +386,7 @@ class Request:
         self.path = url
         #: The query string portion of the URL.
         self.query_string = None
-        #: The parsed query string, as a
-        #: :class:`MultiDict <microdot.MultiDict>` object.
-        self.args = {}
+        self._args = None
         #: A dictionary with the headers included in the request.
         self.headers = headers
         #: A dictionary with the cookies included in the request.
@@ -360,7 +402,6 @@ class Request:
         self.http_version = http_version
         if '?' in self.path:
             self.path, self.query_string = self.path.split('?', 1)
-            self.args = self._parse_urlencoded(self.query_string)
 
         if 'Content-Length' in self.headers:
             self.content_length = int(self.headers['Content-Length'])
@@ -397,26 +438,33 @@ class Request:
         line = (await Request._safe_readline(client_reader)).strip().decode()
         if not line:  # pragma: no cover
             return None
+        app.set_deadline(app.header_timeout)
         method, url, http_version = line.split()
         http_version = http_version.split('/', 1)[1]
 
         # headers
         headers = NoCaseDict()
         content_length = 0
+        allow_list = Request.header_allow_list
         while True:
-            line = (await Request._safe_readline(
-                client_reader)).strip().decode()
-            if line == '':
+            line = await Request._safe_readline(client_reader)
+            if line in (b'\r\n', b'\n', b''):
                 break
-            header, value = line.split(':', 1)
-            value = value.strip()
+            header, value = line.split(b':', 1)
+            header = header.strip().decode()
+            name = header.lower()
+            if allow_list is not None and name not in allow_list and \
+                    name != 'content-length':
+                continue
+            value = value.strip().decode()
             headers[header] = value
-            if header.lower() == 'content-length':
+            if name == 'content-length':
                 content_length = int(value)
 
         # body
         body = b''
         if content_length and content_length <= Request.max_body_length:
+            app.set_deadline(app.body_timeout)
             body = await client_reader.readexactly(content_length)
             stream = None
         else:
@@ -442,6 +490,16 @@ class Request:
                         if len(kv) > 1 else b''
         return data
 
+    @property
+    def args(self):
+        """The parsed query string, as a
+        :class:`MultiDict <microdot.MultiDict>` object. It is parsed the
+        first time it is accessed."""
+        if self._args is None:
+            self._args = {} if self.query_string is None else \
+                self._parse_urlencoded(self.query_string)
+        return self._args
+
     @property
     def body(self):
         """The body of the request, as bytes."""
@@ -540,8 +598,18 @@ class Response:
         'txt': 'text/plain',
     }
 
+    #: The size of the chunks in which file bodies are sent.
     send_file_buffer_size = 1024
 
+    #: The number of file streaming buffers kept for reuse once their
+    #: response is sent.
+    max_pooled_buffers = 2
+    _buffer_pool = []
+
+    #: Bodies, or first body chunks, up to this size are sent in the same
+    #: write as the status line and headers.
+    coalesce_write_size = 1024
+
     #: The content type to use for responses that do not explicitly define a
     #: ``Content-Type`` header.
     default_content_type = 'text/plain'
@@ -570,6 +638,9 @@ class Response:
             # this applies to bytes, file-like objects or generators
             self.body = body
         self.is_head = False
+        #: The number of bytes to send from a file body, or ``None`` to send
+        #: it up to its end.
+        self.body_length = None
 
     def set_cookie(self, cookie, value, path=None, domain=None, expires=None,
                    max_age=None, secure=False, http_only=False,
@@ -622,6 +693,10 @@ class Response:
                         max_age=0, **kwargs)
 
     def complete(self):
+        if self.status_code in (204, 304):
+            # these never have a body, and a 304 may only repeat the
+            # Content-Length of the full response
+            return
         if isinstance(self.body, bytes) and \
                 'Content-Length' not in self.headers:
             self.headers['Content-Length'] = str(len(self.body))
@@ -630,40 +705,76 @@ class Response:
             if 'charset=' not in self.headers['Content-Type']:
                 self.headers['Content-Type'] += '; charset=UTF-8'
 
-    async def write(self, stream):
+    async def write(self, stream, progress=None):
+        """Write the response to ``stream``.
+
+        :param stream: The stream to write to.
+        :param progress: An optional function called after every body chunk
+                         is written.
+        """
         self.complete()
 
         try:
-            # status code
+            # the status line and headers are serialized into one buffer and
+            # sent in a single write, together with the body or its first
+            # chunk when that is small enough
             reason = self.reason if self.reason is not None else \
                 ('OK' if self.status_code == 200 else 'N/A')
-            await stream.awrite('HTTP/1.0 {status_code} {reason}\r\n'.format(
-                status_code=self.status_code, reason=reason).encode())
-
-            # headers
+            head = ['HTTP/1.1 {status_code} {reason}\r\n'.format(
+                status_code=self.status_code, reason=reason)]
             for header, value in self.headers.items():
                 values = value if isinstance(value, list) else [value]
                 for value in values:
-                    await stream.awrite('{header}: {value}\r\n'.format(
-                        header=header, value=value).encode())
-            await stream.awrite(b'\r\n')
+                    head.append('{header}: {value}\r\n'.format(
+                        header=header, value=value))
+            head.append('\r\n')
+            buf = bytearray(''.join(head).encode())
 
             # body
             if not self.is_head:
+                chunked = self.headers.get('Transfer-Encoding') == 'chunked'
+                chunks = 0
                 iter = self.body_iter()
-                async for body in iter:
-                    if isinstance(body, str):  # pragma: no cover
-                        body = body.encode()
-                    try:
+                try:
+                    async for body in iter:
+                        if isinstance(body, str):  # pragma: no cover
+                            body = body.encode()
+                        if chunked:
+                            if not body:
+                                # an empty chunk would end the body early
+                                continue
+                            # the CRLF that ends the previous chunk goes out
+                            # with the size line of this one
+                            size = ('\r\n{:x}\r\n' if chunks
+                                    else '{:x}\r\n').format(len(body)).encode()
+                            chunks += 1
+                            if buf is None:
+                                buf = bytearray(size)
+                            else:
+                                buf += size
+                        if buf is not None:
+                            if len(body) <= self.coalesce_write_size:
+                                buf += body
+                                body = buf
+                            else:
+                                await stream.awrite(buf)
+                            buf = None
                         await stream.awrite(body)
-                    except OSError as exc:  # pragma: no cover
-                        if exc.errno in MUTED_SOCKET_ERRORS or \
-                                exc.args[0] == 'Connection lost':
-                            if hasattr(iter, 'aclose'):
-                                await iter.aclose()
-                        raise
-                if hasattr(iter, 'aclose'):  # pragma: no branch
-                    await iter.aclose()
+                        if progress:
+                            progress()
+                finally:
+                    # also releases the file and its buffer when the write
+                    # fails or the connection is cancelled
+                    if hasattr(iter, 'aclose'):  # pragma: no branch
+                        await iter.aclose()
+                if chunked:
+                    end = b'\r\n0\r\n\r\n' if chunks else b'0\r\n\r\n'
+                    if buf is None:
+                        buf = end
+                    else:
+                        buf += end
+            if buf is not None:
+                await stream.awrite(buf)
 
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS or \
@@ -671,6 +782,24 @@ class Response:
                 pass
             else:
                 raise
+        finally:
+            # HEAD responses and failed head writes never iterate the body,
+            # so file bodies are closed here too
+            if hasattr(self.body, 'close'):
+                result = self.body.close()
+                if iscoroutine(result):  # pragma: no cover
+                    await result
+
+    def _acquire_buffer(self):
+        while Response._buffer_pool:
+            buffer = Response._buffer_pool.pop()
+            if len(buffer) == self.send_file_buffer_size:
+                return buffer
+        return bytearray(self.send_file_buffer_size)
+
+    def _release_buffer(self, buffer):
+        if len(Response._buffer_pool) < self.max_pooled_buffers:
+            Response._buffer_pool.append(buffer)
 
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
@@ -690,6 +819,8 @@ class Response:
                     self.i = self.ITER_UNKNOWN  # need to determine type
                 else:
                     self.i = self.ITER_NO_BODY
+                self.buffer = None
+                self.remaining = response.body_length
                 return self
 
             async def __anext__(self):
@@ -711,14 +842,39 @@ class Response:
                     except StopIteration:
                         await self.aclose()
                         raise StopAsyncIteration
-                buf = response.body.read(response.send_file_buffer_size)
-                if iscoroutine(buf):  # pragma: no cover
-                    buf = await buf
-                if len(buf) < response.send_file_buffer_size:
+                if self.buffer is None and \
+                        hasattr(response.body, 'readinto'):
+                    # files are read into one pooled buffer and sent as
+                    # memoryview slices, so no chunk allocates a new object
+                    self.buffer = response._acquire_buffer()
+                    self.view = memoryview(self.buffer)
+                size = response.send_file_buffer_size
+                if self.remaining is not None and self.remaining < size:
+                    size = self.remaining
+                if self.buffer is not None:
+                    n = response.body.readinto(self.view[:size])
+                    if iscoroutine(n):  # pragma: no cover
+                        n = await n
+                    buf = self.view[:n or 0]
+                else:
+                    buf = response.body.read(size)
+                    if iscoroutine(buf):  # pragma: no cover
+                        buf = await buf
+                if self.remaining is not None:
+                    self.remaining -= len(buf)
+                if len(buf) < response.send_file_buffer_size or \
+                        self.remaining == 0:
                     self.i = self.ITER_NO_BODY
+                if not buf:
+                    await self.aclose()
+                    raise StopAsyncIteration
                 return buf
 
             async def aclose(self):
+                if self.buffer is not None:
+                    self.view = None
+                    response._release_buffer(self.buffer)
+                    self.buffer = None
                 if hasattr(response.body, 'close'):
                     result = response.body.close()
                     if iscoroutine(result):  # pragma: no cover
@@ -797,6 +953,79 @@ class Response:
         return cls(body=f, status_code=status_code, headers=headers)
 
 
+class ResponseCache:
+    """A byte-budgeted LRU cache of serialized responses.
+
+    :param max_bytes: The maximum number of bytes held by the cache, counting
+                      response bodies and header values. Responses larger
+                      than this are never stored.
+
+    Only responses from routes registered with ``cache=True`` are stored,
+    keyed by their path and query string. The application is responsible
+    for invalidating entries when the data behind them changes.
+
+    Example::
+
+        app = Microdot()
+        app.response_cache = ResponseCache(max_bytes=8 * 1024)
+
+        @app.route('/api/data', cache=True)
+        def data(request):
+            return load_data()
+
+        def on_data_changed():
+            app.response_cache.invalidate('/api/data')
+    """
+    def __init__(self, max_bytes=8 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = {}
+        self.lru = []
+
+    @staticmethod
+    def _entry_size(headers, body):
+        return len(body) + sum(len(k) + len(v) for k, v in headers.items())
+
+    def get(self, key):
+        """Return the cached ``(status_code, headers, body)`` tuple for the
+        given key, or ``None`` on a miss."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.lru.remove(key)
+            self.lru.append(key)
+        return entry
+
+    def put(self, key, status_code, headers, body):
+        """Store a response, evicting the least recently used entries until
+        it fits in the byte budget."""
+        self.discard(key)
+        size = self._entry_size(headers, body)
+        if size > self.max_bytes:
+            return
+        while self.size + size > self.max_bytes:
+            self.discard(self.lru[0])
+        self.entries[key] = (status_code, headers, body)
+        self.lru.append(key)
+        self.size += size
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.lru.remove(key)
+            self.size -= self._entry_size(entry[1], entry[2])
+
+    def invalidate(self, path=None):
+        """Remove cached responses.
+
+        :param path: The URL path whose entries are removed, regardless of
+                     their query string. If omitted, the whole cache is
+                     cleared.
+        """
+        for key in self.lru[:]:
+            if path is None or key.split('?', 1)[0] == path:
+                self.discard(key)
+
+
 class URLPattern():
     def __init__(self, url_pattern):
         self.url_pattern = url_pattern
@@ -892,6 +1121,84 @@ class URLPattern():
             return None, None
 
 
+class RouteTable():
+    """Routes compiled for lookup.
+
+    Patterns without arguments go in a dictionary keyed by path. Patterns
+    made of string and int arguments go in a trie with one level per path
+    segment. Patterns that need a regular expression, such as ``path`` and
+    ``re:`` arguments, are tried last, after all the other routes.
+    """
+    def __init__(self, url_map):
+        self.static = {}
+        self.trie = self._node()
+        self.regex = []
+        for order, (methods, pattern, handler) in enumerate(url_map):
+            route = (order, methods, handler)
+            if pattern.regex:
+                self.regex.append((route, pattern))
+            elif all('name' not in segment for segment in pattern.segments):
+                path = '/' + pattern.url_pattern.lstrip('/')
+                self.static.setdefault(path, []).append(route)
+            else:
+                node = self.trie
+                for segment in pattern.url_pattern.lstrip('/').split('/'):
+                    if segment and segment[0] == '<':
+                        segment = segment[1:-1]
+                        type_ = 'string'
+                        if ':' in segment:
+                            type_, segment = segment.rsplit(':', 1)
+                        key = (type_, segment)
+                        node = node['params'].setdefault(key, self._node())
+                    else:
+                        node = node['static'].setdefault(segment,
+                                                         self._node())
+                node['routes'].append(route)
+
+    @staticmethod
+    def _node():
+        return {'static': {}, 'params': {}, 'routes': []}
+
+    def match(self, path):
+        """Generate the routes matching ``path`` as
+        ``(order, methods, handler, url_args)`` tuples. Dictionary and trie
+        matches come first, in registration order, followed by the regular
+        expression routes, which are only evaluated if the caller asks for
+        more."""
+        matches = [route + ({},) for route in self.static.get(path, ())]
+        if len(path) > 0 and path[0] == '/':
+            self._match_node(self.trie, path[1:].split('/'), 0, {}, matches)
+        matches.sort(key=lambda match: match[0])
+        for match in matches:
+            yield match
+        for route, pattern in self.regex:
+            args = pattern.match(path)
+            if args is not None:
+                yield route + (args,)
+
+    def _match_node(self, node, segments, i, args, matches):
+        if i == len(segments):
+            for route in node['routes']:
+                matches.append(route + (dict(args),))
+            return
+        segment = segments[i]
+        child = node['static'].get(segment)
+        if child is not None:
+            self._match_node(child, segments, i + 1, args, matches)
+        if not segment:
+            return
+        for (type_, name), child in node['params'].items():
+            value = segment
+            if type_ == 'int':
+                try:
+                    value = int(segment)
+                except ValueError:
+                    continue
+            args[name] = value
+            self._match_node(child, segments, i + 1, args, matches)
+            del args[name]
+
+
 class HTTPException(Exception):
     def __init__(self, status_code, reason=None):
         self.status_code = status_code
@@ -917,6 +1224,7 @@ class Microdot:
 
     def __init__(self):
         self.url_map = []
+        self.route_table = None
         self.before_request_handlers = []
         self.after_request_handlers = []
         self.after_error_request_handlers = []
@@ -925,8 +1233,66 @@ class Microdot:
         self.options_handler = self.default_options_handler
         self.debug = False
         self.server = None
-
-    def route(self, url_pattern, methods=None):
+        #: A :class:`ResponseCache` instance used to store responses of
+        #: routes registered with ``cache=True``. Caching is disabled when
+        #: this is ``None``.
+        self.response_cache = None
+        self.cached_handlers = []
+        self.coalesced_handlers = []
+        self.in_flight = {}
+        #: Seconds an idle persistent connection waits for its next request.
+        self.keep_alive_timeout = 5
+        #: Seconds allowed for the request line and headers to arrive, and
+        #: for a new connection to send its first request line.
+        self.header_timeout = 10
+        #: Seconds allowed for a request body to arrive.
+        self.body_timeout = 20
+        #: Seconds allowed for a request to be dispatched.
+        self.request_timeout = 30
+        #: Seconds a response write may go without sending a body chunk.
+        #: Slow clients can take longer in total as long as the transfer
+        #: keeps making progress.
+        self.write_timeout = 10
+        #: Seconds between checks for connections past their deadline.
+        self.reaper_interval = 1
+        self.connections = {}
+        self.reaper = None
+        #: Maximum number of requests served on one connection before it is
+        #: closed. Set to 1 to disable persistent connections.
+        self.max_keep_alive_requests = 20
+        #: Maximum number of requests dispatched at the same time.
+        self.max_concurrent_requests = 3
+        #: Maximum number of parsed requests waiting for a free dispatch
+        #: slot. Requests beyond it are answered with a 503 status code.
+        self.max_queued_requests = 4
+        #: Free heap, in bytes, below which new requests are answered with a
+        #: 503 status code before they are parsed. Disabled when ``None``
+        #: and on CPython.
+        self.min_free_memory = None
+        #: Seconds sent in the ``Retry-After`` header of 503 responses.
+        self.retry_after = 5
+        #: Maximum number of bytes of an unparsed request that are read and
+        #: discarded after a 503 response, before the connection is closed.
+        self.reject_drain_bytes = 2048
+        #: Seconds spent at most discarding an unparsed request.
+        self.reject_drain_timeout = 0.5
+        self.reject_scratch = bytearray(128)
+        self.active_requests = 0
+        self.queued_requests = 0
+        self.request_slot = asyncio.Event()
+        #: If ``True``, sync handlers are called directly in the asyncio
+        #: thread under CPython instead of in a thread pool executor. Routes
+        #: can also opt in individually with ``inline=True``. MicroPython
+        #: always calls handlers inline.
+        self.inline_sync_handlers = False
+        self.inline_handlers = []
+        #: Maximum number of threads running sync handlers under CPython.
+        #: ``None`` uses the event loop's default executor.
+        self.max_handler_threads = None
+        self.executor = None
+
+    def route(self, url_pattern, methods=None, cache=False, coalesce=False,
+              inline=False):
         """Decorator that is used to register a function as a request handler
         for a given URL.
 
@@ -935,6 +1301,17 @@ class Microdot:
         :param methods: The list of HTTP methods to be handled by the
                         decorated function. If omitted, only ``GET`` requests
                         are handled.
+        :param cache: If ``True``, successful ``GET`` responses with a bytes
+                      body are stored in :attr:`response_cache` and served
+                      from it until invalidated. Cached routes are also
+                      coalesced.
+        :param coalesce: If ``True``, concurrent ``GET`` requests for the
+                         same path and query string share a single
+                         invocation of the handler. Only use this for
+                         handlers whose response depends on the URL alone.
+        :param inline: If ``True``, a sync handler is called directly in the
+                       asyncio thread under CPython, skipping the thread
+                       pool. Only use this for handlers that do not block.
 
         The URL pattern can be a static path (for example, ``/users`` or
         ``/api/invoices/search``) or a path with dynamic components enclosed
@@ -960,6 +1337,13 @@ class Microdot:
             self.url_map.append(
                 ([m.upper() for m in (methods or ['GET'])],
                  URLPattern(url_pattern), f))
+            self.route_table = None
+            if cache:
+                self.cached_handlers.append(f)
+            if cache or coalesce:
+                self.coalesced_handlers.append(f)
+            if inline:
+                self.inline_handlers.append(f)
             return f
         return decorated
 
@@ -1137,6 +1521,7 @@ class Microdot:
             self.url_map.append(
                 (methods, URLPattern(url_prefix + pattern.url_pattern),
                  handler))
+        self.route_table = None
         for handler in subapp.before_request_handlers:
             self.before_request_handlers.append(handler)
         for handler in subapp.after_request_handlers:
@@ -1145,6 +1530,12 @@ class Microdot:
             self.after_error_request_handlers.append(handler)
         for status_code, handler in subapp.error_handlers.items():
             self.error_handlers[status_code] = handler
+        for handler in subapp.cached_handlers:
+            self.cached_handlers.append(handler)
+        for handler in subapp.coalesced_handlers:
+            self.coalesced_handlers.append(handler)
+        for handler in subapp.inline_handlers:
+            self.inline_handlers.append(handler)
 
     @staticmethod
     def abort(status_code, reason=None):
@@ -1306,37 +1697,121 @@ class Microdot:
         if method == 'HEAD':
             method = 'GET'
         f = 404
-        for route_methods, route_pattern, route_handler in self.url_map:
-            req.url_args = route_pattern.match(req.path)
-            if req.url_args is not None:
-                if method in route_methods:
-                    f = route_handler
-                    break
-                else:
-                    f = 405
+        for _, route_methods, route_handler, url_args in \
+                self._routes().match(req.path):
+            if method in route_methods:
+                req.url_args = url_args
+                f = route_handler
+                break
+            else:
+                f = 405
         return f
 
+    def _routes(self):
+        if self.route_table is None:
+            self.route_table = RouteTable(self.url_map)
+        return self.route_table
+
     def default_options_handler(self, req):
         allow = []
-        for route_methods, route_pattern, route_handler in self.url_map:
-            if route_pattern.match(req.path) is not None:
-                allow.extend(route_methods)
+        for _, route_methods, _, _ in self._routes().match(req.path):
+            allow.extend(route_methods)
         if 'GET' in allow:
             allow.append('HEAD')
         allow.append('OPTIONS')
         return {'Allow': ', '.join(allow)}
 
+    @staticmethod
+    def _make_response(res):
+        if isinstance(res, tuple):
+            body = res[0]
+            if isinstance(res[1], int):
+                status_code = res[1]
+                headers = res[2] if len(res) > 2 else {}
+            else:
+                status_code = 200
+                headers = res[1]
+            res = Response(body, status_code, headers)
+        elif not isinstance(res, Response):
+            res = Response(res)
+        return res
+
+    def _cacheable(self, f, req):
+        return self.response_cache is not None and \
+            req.method in ('GET', 'HEAD') and f in self.cached_handlers
+
+    @staticmethod
+    def _shareable(res):
+        return isinstance(res.body, bytes) and 'Set-Cookie' not in res.headers
+
+    def _cached_response(self, f, req):
+        if not self._cacheable(f, req):
+            return None
+        entry = self.response_cache.get(req.url)
+        if entry is None:
+            return None
+        status_code, headers, body = entry
+        return Response(body, status_code, headers)
+
+    def _cache_response(self, f, req, res):
+        if self._cacheable(f, req) and res.status_code == 200 and \
+                self._shareable(res):
+            self.response_cache.put(req.url, res.status_code,
+                                    dict(res.headers), res.body)
+
+    async def _invoke(self, handler, *args, **kwargs):
+        if self.executor is None and self.max_handler_threads:
+            self.executor = _create_executor(self.max_handler_threads)
+        return await _invoke_handler(
+            handler,
+            self.inline_sync_handlers or handler in self.inline_handlers,
+            self.executor, *args, **kwargs)
+
+    async def _invoke_route(self, f, req):
+        res = self._cached_response(f, req)
+        if res is not None:
+            return res
+        if req.method not in ('GET', 'HEAD') or \
+                f not in self.coalesced_handlers:
+            return await self._invoke(f, req, **req.url_args)
+
+        # single-flight: concurrent requests for the same URL wait for the
+        # first one and reuse its response instead of building their own
+        flight = self.in_flight.get(req.url)
+        if flight is not None:
+            event, shared = flight
+            await event.wait()
+            if shared:
+                status_code, headers, body = shared[0]
+                return Response(body, status_code, headers)
+            return await self._invoke(f, req, **req.url_args)
+
+        event = asyncio.Event()
+        shared = []
+        self.in_flight[req.url] = (event, shared)
+        try:
+            res = self._make_response(await self._invoke(
+                f, req, **req.url_args))
+            if self._shareable(res):
+                shared.append((res.status_code, dict(res.headers), res.body))
+            self._cache_response(f, req, res)
+        finally:
+            del self.in_flight[req.url]
+            event.set()
+        return res
+
     async def handle_request(self, reader, writer):
-        req = None
+        task = asyncio.current_task()
+        self.connections[task] = None
+        if self.reaper is None:
+            self.reaper = asyncio.create_task(self._reap())
         try:
-            req = await Request.create(self, reader, writer,
-                                       writer.get_extra_info('peername'))
-        except Exception as exc:  # pragma: no cover
-            print_exception(exc)
-
-        res = await self.dispatch_request(req)
-        if res != Response.already_handled:  # pragma: no branch
-            await res.write(writer)
+            await self._serve_connection(reader, writer)
+        except asyncio.CancelledError:
+            # the reaper cancels connections that are past their deadline
+            pass
+        finally:
+            del self.connections[task]
         try:
             await writer.aclose()
         except OSError as exc:  # pragma: no cover
@@ -1344,17 +1819,165 @@ class Microdot:
                 pass
             else:
                 raise
-        if self.debug and req:  # pragma: no cover
-            print('{method} {path} {status_code}'.format(
-                method=req.method, path=req.path,
-                status_code=res.status_code))
+
+    async def _serve_connection(self, reader, writer):
+        requests = 0
+        while True:
+            if self._low_memory():
+                await self._reject(writer)
+                await self._discard_input(reader)
+                break
+            # an idle persistent connection only waits so long for the next
+            # request
+            self.set_deadline(
+                self.keep_alive_timeout if requests else self.header_timeout)
+            req = None
+            try:
+                req = await Request.create(
+                    self, reader, writer, writer.get_extra_info('peername'))
+            except Exception as exc:  # pragma: no cover
+                print_exception(exc)
+            if requests and req is None:
+                # the client closed the persistent connection
+                break
+            requests += 1
+
+            if not await self._acquire_slot():
+                await self._reject(writer)
+                break
+            self.set_deadline(self.request_timeout)
+            try:
+                res = await self.dispatch_request(req)
+                keep_alive = self._keep_alive(req, res, requests)
+                if res != Response.already_handled:  # pragma: no branch
+                    res.headers['Connection'] = \
+                        'keep-alive' if keep_alive else 'close'
+                    self.set_deadline(self.write_timeout)
+                    await res.write(writer, self._write_progress)
+            finally:
+                self._release_slot()
+            if self.debug and req:  # pragma: no cover
+                print('{method} {path} {status_code}'.format(
+                    method=req.method, path=req.path,
+                    status_code=res.status_code))
+            if not keep_alive:
+                break
+
+    def set_deadline(self, timeout):
+        """Give the connection of the running request ``timeout`` more
+        seconds before it is closed. Handlers that are known to be slow can
+        call this to extend :attr:`request_timeout`.
+
+        :param timeout: The number of seconds from now.
+        """
+        task = asyncio.current_task()
+        if task in self.connections:
+            self.connections[task] = ticks_add(ticks_ms(),
+                                               int(timeout * 1000))
+
+    def _write_progress(self):
+        self.set_deadline(self.write_timeout)
+
+    async def _reap(self):
+        # closes connections that are past their deadline, and stops once
+        # there are no connections left to watch
+        try:
+            while self.connections:
+                await asyncio.sleep(self.reaper_interval)
+                now = ticks_ms()
+                for task, deadline in list(self.connections.items()):
+                    if deadline is not None and \
+                            ticks_diff(deadline, now) < 0:
+                        self.connections[task] = None
+                        task.cancel()
+        finally:
+            self.reaper = None
+
+    def _low_memory(self):
+        if self.min_free_memory is None or mem_free is None:
+            return False
+        if mem_free() >= self.min_free_memory:
+            return False
+        collect()
+        return mem_free() < self.min_free_memory
+
+    async def _acquire_slot(self):
+        if self.active_requests >= self.max_concurrent_requests:
+            if self.queued_requests >= self.max_queued_requests:
+                return False
+            self.queued_requests += 1
+            try:
+                while self.active_requests >= self.max_concurrent_requests:
+                    await self.request_slot.wait()
+                    self.request_slot.clear()
+            finally:
+                self.queued_requests -= 1
+        self.active_requests += 1
+        return True
+
+    def _release_slot(self):
+        self.active_requests -= 1
+        self.request_slot.set()
+
+    async def _reject(self, writer):
+        try:
+            await writer.awrite(
+                'HTTP/1.1 503 Service Unavailable\r\nRetry-After: {}\r\n'
+                'Connection: close\r\nContent-Length: 0\r\n\r\n'.format(
+                    self.retry_after).encode())
+        except OSError as exc:  # pragma: no cover
+            if exc.errno not in MUTED_SOCKET_ERRORS:
+                raise
+
+    async def _discard_input(self, reader):
+        # closing a socket with unread data resets the connection, and the
+        # reset can drop the response that was just written
+        remaining = self.reject_drain_bytes
+        deadline = ticks_add(ticks_ms(), int(self.reject_drain_timeout * 1000))
+        while remaining > 0:
+            timeout = ticks_diff(deadline, ticks_ms())
+            if timeout <= 0:
+                break
+            try:
+                if hasattr(reader, 'readinto'):
+                    n = await asyncio.wait_for(
+                        reader.readinto(self.reject_scratch), timeout / 1000)
+                else:
+                    n = len(await asyncio.wait_for(
+                        reader.read(len(self.reject_scratch)), timeout / 1000))
+            except (asyncio.TimeoutError, OSError):
+                break
+            if not n:
+                break
+            remaining -= n
+
+    def _keep_alive(self, req, res, requests):
+        if req is None or res == Response.already_handled or \
+                requests >= self.max_keep_alive_requests:
+            return False
+        connection = req.headers.get('Connection', '').lower()
+        if req.http_version == '1.0':
+            if connection != 'keep-alive':
+                return False
+        elif connection == 'close':
+            return False
+        if res.headers.get('Connection', '').lower() == 'close':
+            return False
+        if req.content_length and req._stream is not None:
+            # the request body was left unread on the connection
+            return False
+        # without a known length or chunked framing the end of the body is
+        # the end of the connection
+        return isinstance(res.body, bytes) or \
+            'Content-Length' in res.headers or \
+            res.headers.get('Transfer-Encoding') == 'chunked'
 
     async def dispatch_request(self, req):
         after_request_handled = False
         if req:
             if req.content_length > req.max_content_length:
                 if 413 in self.error_handlers:
-                    res = await invoke_handler(self.error_handlers[413], req)
+                    res = await self._invoke(self.error_handlers[413], req)
                 else:
                     res = 'Payload too large', 413
             else:
@@ -1363,34 +1986,23 @@ class Microdot:
                     res = None
                     if callable(f):
                         for handler in self.before_request_handlers:
-                            res = await invoke_handler(handler, req)
+                            res = await self._invoke(handler, req)
                             if res:
                                 break
                         if res is None:
-                            res = await invoke_handler(
-                                f, req, **req.url_args)
-                        if isinstance(res, tuple):
-                            body = res[0]
-                            if isinstance(res[1], int):
-                                status_code = res[1]
-                                headers = res[2] if len(res) > 2 else {}
-                            else:
-                                status_code = 200
-                                headers = res[1]
-                            res = Response(body, status_code, headers)
-                        elif not isinstance(res, Response):
-                            res = Response(res)
+                            res = await self._invoke_route(f, req)
+                        res = self._make_response(res)
                         for handler in self.after_request_handlers:
-                            res = await invoke_handler(
+                            res = await self._invoke(
                                 handler, req, res) or res
                         for handler in req.after_request_handlers:
-                            res = await invoke_handler(
+                            res = await self._invoke(
                                 handler, req, res) or res
                         after_request_handled = True
                     elif isinstance(f, dict):
                         res = Response(headers=f)
                     elif f in self.error_handlers:
-                        res = await invoke_handler(self.error_handlers[f], req)
+                        res = await self._invoke(self.error_handlers[f], req)
                     else:
                         res = 'Not found', f
                 except HTTPException as exc:
@@ -1411,19 +2023,19 @@ class Microdot:
                                 break
                     if exc_class:
                         try:
-                            res = await invoke_handler(
+                            res = await self._invoke(
                                 self.error_handlers[exc_class], req, exc)
                         except Exception as exc2:  # pragma: no cover
                             print_exception(exc2)
                     if res is None:
                         if 500 in self.error_handlers:
-                            res = await invoke_handler(
+                            res = await self._invoke(
                                 self.error_handlers[500], req)
                         else:
                             res = 'Internal server error', 500
         else:
             if 400 in self.error_handlers:
-                res = await invoke_handler(self.error_handlers[400], req)
+                res = await self._invoke(self.error_handlers[400], req)
             else:
                 res = 'Bad request', 400
         if isinstance(res, tuple):
@@ -1432,11 +2044,79 @@ class Microdot:
             res = Response(res)
         if not after_request_handled:
             for handler in self.after_error_request_handlers:
-                res = await invoke_handler(
+                res = await self._invoke(
                     handler, req, res) or res
         res.is_head = (req and req.method == 'HEAD')
+        if req and req.method in ('GET', 'HEAD'):
+            self._apply_range(req, res)
+        if req and req.http_version != '1.0' and not res.is_head and \
+                self._streamed(res):
+            # HTTP/1.1 clients get streamed bodies framed as chunks, so the
+            # connection can be reused without knowing the length upfront
+            res.headers['Transfer-Encoding'] = 'chunked'
         return res
 
+    @staticmethod
+    def _apply_range(req, res):
+        # seekable file bodies are sent with their length, and a single
+        # byte range is honored so that interrupted downloads can resume
+        if res.status_code != 200 or 'Content-Length' in res.headers or \
+                not hasattr(res.body, 'seek'):
+            return
+        try:
+            start = res.body.tell()
+            size = res.body.seek(0, 2) - start
+            res.body.seek(start)
+        except (AttributeError, OSError):  # pragma: no cover
+            return
+        res.headers['Accept-Ranges'] = 'bytes'
+        res.headers['Content-Length'] = str(size)
+        byte_range = req.headers.get('Range', '')
+        if not byte_range.startswith('bytes=') or ',' in byte_range:
+            return
+        if 'If-Range' in req.headers and \
+                req.headers['If-Range'] != res.headers.get('ETag'):
+            # the client's copy is a different version of the file
+            return
+        first, _, last = byte_range[6:].strip().partition('-')
+        try:
+            if first:
+                first = int(first)
+                if last:
+                    last = int(last)
+                    if last < first:
+                        return
+                    last = min(last, size - 1)
+                else:
+                    last = size - 1
+            else:
+                first = max(size - int(last), 0)
+                last = size - 1
+        except ValueError:
+            return
+        if first >= size or last < 0:
+            res.body.close()
+            res.body = b''
+            res.status_code = 416
+            res.reason = 'Range Not Satisfiable'
+            res.headers['Content-Range'] = 'bytes */{}'.format(size)
+            res.headers['Content-Length'] = '0'
+            return
+        res.body.seek(start + first)
+        res.body_length = last - first + 1
+        res.status_code = 206
+        res.reason = 'Partial Content'
+        res.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            first, last, size)
+        res.headers['Content-Length'] = str(res.body_length)
+
+    @staticmethod
+    def _streamed(res):
+        return res != Response.already_handled and \
+            res.body is not None and not isinstance(res.body, bytes) and \
+            'Content-Length' not in res.headers and \
+            res.status_code >= 200 and res.status_code not in (204, 304)
+
 
 Response.already_handled = Response()
 
@@ -0,0 +1,53 @@
+from json import dumps
+from time import ticks_ms, ticks_diff  # type: ignore
+from typing import Optional, Tuple
+from components.microdot import Request
+
+RATE_LIMIT_MAX_CLIENTS = 16
+
+
+class RateLimiter:
+    # Token bucket per client IP, checked before any handler runs. Every request takes its
+    # route's cost in tokens, and buckets refill at `rate` tokens per second up to `burst`.
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        costs: dict[str, float],
+        default_cost: float = 1,
+        max_clients: int = RATE_LIMIT_MAX_CLIENTS,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.costs = costs
+        self.default_cost = default_cost
+        self.max_clients = max_clients
+        self.buckets: dict[str, list] = {}  # ip -> [tokens, ticks_ms of last refill]
+
+    def _bucket(self, ip: str, now: int) -> list:
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                # forget the client that has been quiet the longest, it would be refilled by now anyway
+                stalest = max(self.buckets, key=lambda key: ticks_diff(now, self.buckets[key][1]))
+                del self.buckets[stalest]
+            bucket = [self.burst, now]
+            self.buckets[ip] = bucket
+        else:
+            elapsed_ms = ticks_diff(now, bucket[1])
+            bucket[0] = min(self.burst, bucket[0] + elapsed_ms * self.rate / 1000)
+            bucket[1] = now
+        return bucket
+
+    def check(self, request: Request) -> Optional[Tuple[str, int, dict[str, str]]]:
+        cost = self.costs.get(request.path, self.default_cost)
+        if not cost or not request.client_addr:
+            return None
+        bucket = self._bucket(request.client_addr[0], ticks_ms())
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return None
+        retry_after = int((cost - bucket[0]) / self.rate) + 1
+        return dumps({"error": "too many requests"}), 429, {"Retry-After": str(retry_after)}
+
@@ -1,15 +1,22 @@
 from components.web_real_time_clock import WebRealTimeClock
-from typing import Tuple, Any, Optional
+from components.trend import TrendModel
+from components.sparkline import render_sparkline, SPARKLINE_POINTS
+from typing import Tuple, Any, Optional, Callable
 from os import remove, rename, listdir, mkdir
-from machine import Timer, Pin, ADC, I2C  # type: ignore
-from json import load, dump
+from machine import Pin, ADC, I2C  # type: ignore
+from heapq import heappush, heappop
+import asyncio
+from json import load, dump, dumps
 from uos import urandom  # type: ignore
 from ubinascii import hexlify  # type: ignore
-from time import sleep
+from time import sleep, ticks_ms, ticks_diff  # type: ignore
+from math import log, exp
 from gc import collect
 
 HISTORY_LENGTH = 168
 SAMPLING_FREQUENCY_SECONDS = 1800
+MIN_VALID_UNIX_TIME = 1282542159  # samples stamped before NTP sync are left out of payloads
+SAME_TICK_MS = 10000  # source readings younger than this count as the current tick for derived sensors
 CONFIG_FILE = "config.json"
 
 def save_config(updated_config: dict[str, Any]) -> None:  # TODO: relocate
@@ -22,11 +29,38 @@ def generate_uuid() -> str:
     return f"{uuid[:8]}-{uuid[8:12]}-{uuid[12:16]}-{uuid[16:20]}-{uuid[20:]}"
 
 class Sensor:
+    last_value: Optional[float] = None
+    last_read_ticks_ms: int = 0
+    lock: Any = None
+
     def __init__(self) -> None:
         pass
 
-    def data_interface(self) -> float:
+    async def data_interface(self) -> Optional[float]:
         return 0.0
+
+    async def read(self) -> Optional[float]:
+        # reads the sensor and keeps the value for derived sensors of the same tick
+        started_ticks_ms = ticks_ms()
+        self.last_value = await self.data_interface()
+        self.last_read_ticks_ms = started_ticks_ms
+        return self.last_value
+
+    def age_ms(self) -> int:
+        return ticks_diff(ticks_ms(), self.last_read_ticks_ms)
+
+    async def read_fresh(self, max_age_ms: int) -> Optional[float]:
+        if self.last_value is not None and self.age_ms() < max_age_ms:
+            return self.last_value
+        # Hardware reads yield while the sensor settles, so callers arriving meanwhile wait for
+        # that read and share its value instead of starting an interleaved transaction.
+        requested_ticks_ms = ticks_ms()
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.last_value is not None and ticks_diff(self.last_read_ticks_ms, requested_ticks_ms) >= 0:
+                return self.last_value
+            return await self.read()
     
     def limits(self) -> Tuple[int, int]:
         return 0, 100
@@ -48,19 +82,19 @@ class MoistureSensor(Sensor):
         self.name = name
         self.uuid = uuid
 
-    def data_interface(self) -> float:
-        return float(self.percentage())
+    async def data_interface(self) -> float:
+        return float(await self.percentage())
 
-    def voltage(self) -> float:
+    async def voltage(self) -> float:
         self.adc_power_pin.value(1)
-        sleep(0.01)
+        await asyncio.sleep(0.01)
         adc_value = self.adc.read_u16()
         self.adc_power_pin.value(0)
         voltage = float(adc_value * 3.3 / 65535)
         return voltage
 
-    def percentage(self) -> float:
-        voltage = self.voltage()
+    async def percentage(self) -> float:
+        voltage = await self.voltage()
         percentage = round(
             (
                 1
@@ -79,8 +113,13 @@ class MoistureSensor(Sensor):
 
 
 class AHT10:
+    max_age_ms = 1000  # temperature and humidity sampled within this window share one measurement
+
     def __init__(self, i2c_address: str, i2c_bus: int, i2c_sda_pin: int, i2c_scl_pin: int, power_pin: int) -> None:
         self.i2c_address = i2c_address
+        self.data: Optional[bytes] = None
+        self.data_ticks_ms = 0
+        self.lock = asyncio.Lock()
         self.power_pin = Pin(power_pin, Pin.OUT)
         self.power_pin.value(1)  # power on AHT10
         sleep(0.1)  # waith for AHT10 power up
@@ -98,13 +137,22 @@ class AHT10:
                     continue
                 raise e
 
-    def _read_data(self) -> bytes:
+    async def _read_data(self) -> bytes:
+        # the lock keeps the temperature and humidity sensors of one chip from interleaving
+        async with self.lock:
+            return await self._measure()
+
+    async def _measure(self) -> bytes:
+        if self.data and ticks_diff(ticks_ms(), self.data_ticks_ms) < self.max_age_ms:
+            return self.data
         for i in range(10):
             try:
                 self.i2c.writeto(int(self.i2c_address), b"\xAC\x33\x00")
-                sleep(0.1)
+                await asyncio.sleep(0.1)
                 data: bytes = self.i2c.readfrom(int(self.i2c_address), 6)
-                sleep(0.1)
+                await asyncio.sleep(0.1)
+                self.data = data
+                self.data_ticks_ms = ticks_ms()
                 return data
             except OSError as e:
                 if i < 9:
@@ -112,8 +160,8 @@ class AHT10:
                 raise e
         raise Exception("AHT10 read failed")
 
-    def get_temperature_and_humidity(self) -> Tuple[float, float]:
-        data = self._read_data()
+    async def get_temperature_and_humidity(self) -> Tuple[float, float]:
+        data = await self._read_data()
         humidity_int: int = ((data[1] << 16) | (data[2] << 8) | data[3]) >> 4
         temperature_int: int = ((data[3] & 0x0F) << 16) | (data[4] << 8) | data[5]
 
@@ -122,14 +170,14 @@ class AHT10:
 
         return temperature, humidity
 
-    def get_temperature(self) -> float:
-        data = self._read_data()
+    async def get_temperature(self) -> float:
+        data = await self._read_data()
         temperature_int: int = ((data[3] & 0x0F) << 16) | (data[4] << 8) | data[5]
         temperature: float = ((temperature_int * 200) / 1048576) - 53
         return temperature
 
-    def get_humidity(self) -> float:
-        data = self._read_data()
+    async def get_humidity(self) -> float:
+        data = await self._read_data()
         humidity_int: int = ((data[1] << 16) | (data[2] << 8) | data[3]) >> 4
         humidity: float = (humidity_int * 100) / 1048576
         return humidity
@@ -139,11 +187,11 @@ class AHT10TemperatureSensor(Sensor):
     def __init__(self, aht10: AHT10) -> None:
         self.aht10 = aht10
 
-    def data_interface(self) -> float:
-        return round(self.read_temperature(), 1)
+    async def data_interface(self) -> float:
+        return round(await self.read_temperature(), 1)
 
-    def read_temperature(self) -> float:
-        return self.aht10.get_temperature()
+    async def read_temperature(self) -> float:
+        return await self.aht10.get_temperature()
     
     def limits(self) -> Tuple[int, int]:
         return 0, 100
@@ -153,11 +201,11 @@ class AHT10HumiditySensor(Sensor):
     def __init__(self, aht10: AHT10):
         self.aht10 = aht10
 
-    def data_interface(self) -> float:
-        return round(self.read_humidity(), 1)
+    async def data_interface(self) -> float:
+        return round(await self.read_humidity(), 1)
 
-    def read_humidity(self) -> float:
-        return self.aht10.get_humidity()
+    async def read_humidity(self) -> float:
+        return await self.aht10.get_humidity()
     
     def limits(self) -> Tuple[int, int]:
         return 0, 100
@@ -167,7 +215,7 @@ class PicoTemperatureSensor(Sensor):
     conversion_factor = 3.3 / (65535)
     temperature_sensor = ADC(4)
 
-    def data_interface(self) -> float:
+    async def data_interface(self) -> float:
         return round(self.read_temperature(), 1)
 
     def read_temperature(self) -> float:
@@ -180,6 +228,43 @@ class PicoTemperatureSensor(Sensor):
         return 0, 100
 
 
+class DerivedSensor(Sensor):
+    # Computed from the cached readings of other sensors taken in the same tick, no hardware access
+    def __init__(self, temperature: Sensor, humidity: Sensor, name: str) -> None:
+        self.temperature = temperature
+        self.humidity = humidity
+        self.name = name
+
+    async def data_interface(self) -> Optional[float]:
+        if self.temperature.last_value is None or self.humidity.last_value is None:
+            return None
+        relative_humidity = max(0.1, min(100.0, self.humidity.last_value))
+        return round(self.derive(self.temperature.last_value, relative_humidity), 2)
+
+    def derive(self, temperature: float, relative_humidity: float) -> float:
+        return 0.0
+
+    async def read_fresh(self, max_age_ms: int) -> Optional[float]:
+        # live reads refresh stale sources first, sampling ticks find them already fresh
+        await self.temperature.read_fresh(max(max_age_ms, SAME_TICK_MS))
+        await self.humidity.read_fresh(max(max_age_ms, SAME_TICK_MS))
+        return await super().read_fresh(max_age_ms)
+
+
+class DewPointSensor(DerivedSensor):
+    def derive(self, temperature: float, relative_humidity: float) -> float:
+        # Magnus formula, celsius
+        gamma = log(relative_humidity / 100) + 17.62 * temperature / (243.12 + temperature)
+        return 243.12 * gamma / (17.62 - gamma)
+
+
+class VapourPressureDeficitSensor(DerivedSensor):
+    def derive(self, temperature: float, relative_humidity: float) -> float:
+        # Tetens equation, kPa
+        saturation_pressure = 0.6108 * exp(17.27 * temperature / (temperature + 237.3))
+        return saturation_pressure * (1 - relative_humidity / 100)
+
+
 class PersistentList:
 
     storage_memory_mode = False
@@ -251,20 +336,84 @@ class SensorHistory:  # TODO: this class is redundant, merge it with PersistentL
     storage_memory_mode: bool = False
 
     def __init__(
-        self, filename: str, length: int, rtc: WebRealTimeClock, sensor_type: str
+        self, filename: str, length: int, rtc: WebRealTimeClock, sensor_type: str, index: int
     ):
         self.sensor_type = sensor_type
+        self.index = index
         self.rtc = rtc
+        self.listeners: list[Callable] = []
+        self.name: str = sensor_type
+        self.limits: Tuple[int, int] = (0, 100)
+        self.trend: Optional[TrendModel] = None
         self.persistent_history = PersistentList(
             filename=filename, max_lines=HISTORY_LENGTH
         )
+        self.payload_file = f"{self.persistent_history.filename}.json"
+        self.sparkline_file = f"{self.persistent_history.filename}.svg"
         print(f"Loaded {len(self.persistent_history.get_content())} values from {filename}")
         self.length = length
 
     def add(self, value: float) -> list[Tuple[float, int]]:
         event_unix_time = self.rtc.get_current_unix_time()
         self.persistent_history.append(value, event_unix_time)
-        return self.persistent_history.get_content()  # TODO: find out if this return is necessary
+        content = self.persistent_history.get_content()
+        self.render(content)
+        if self.trend and event_unix_time >= MIN_VALID_UNIX_TIME:
+            self.trend.add(value, event_unix_time)
+        for listener in self.listeners:
+            listener(self, value, event_unix_time)
+        return content  # TODO: find out if this return is necessary
+
+    def track_trend(self, target: float) -> None:
+        # the stored history is replayed once here, afterwards every sample updates the model in O(1)
+        self.trend = TrendModel(target=target)
+        for value, event_unix_time in self.get():
+            if event_unix_time >= MIN_VALID_UNIX_TIME:
+                self.trend.add(value, event_unix_time)
+
+    def render(self, content: Optional[list[Tuple[float, int]]] = None) -> None:
+        # The API bodies derived from the history only change when a sample is added, so they
+        # are written to flash here and streamed as is instead of being built per request.
+        if content is None:
+            content = self.get()
+        self.render_payload(content)
+        self.render_sparkline(content)
+
+    def render_sparkline(self, content: list[Tuple[float, int]]) -> None:
+        temporary_file_name = f"{self.sparkline_file}.tmp"
+        with open(temporary_file_name, "w") as f:
+            f.write(render_sparkline([
+                value for value, event_unix_time in content[-SPARKLINE_POINTS:]
+                if event_unix_time >= MIN_VALID_UNIX_TIME
+            ]))
+        self._replace_file(temporary_file_name, self.sparkline_file)
+
+    def _replace_file(self, temporary_file_name: str, file_name: str) -> None:
+        try:
+            remove(file_name)
+        except OSError:
+            pass
+        rename(temporary_file_name, file_name)
+
+    def render_payload(self, content: list[Tuple[float, int]]) -> None:
+        temporary_file_name = f"{self.payload_file}.tmp"
+        with open(temporary_file_name, "w") as f:
+            f.write('{"index": %d, "name": %s, "type": %s, "times": [' % (
+                self.index, dumps(self.name), dumps(self.sensor_type)
+            ))
+            separator = ""
+            for _, event_unix_time in content:
+                if event_unix_time >= MIN_VALID_UNIX_TIME:
+                    f.write(f"{separator}{event_unix_time}")
+                    separator = ", "
+            f.write('], "values": [')
+            separator = ""
+            for value, event_unix_time in content:
+                if event_unix_time >= MIN_VALID_UNIX_TIME:
+                    f.write(f"{separator}{dumps(value)}")
+                    separator = ", "
+            f.write('], "min": %s, "max": %s}' % (dumps(self.limits[0]), dumps(self.limits[1])))
+        self._replace_file(temporary_file_name, self.payload_file)
 
     def get(self) -> list[Tuple[float, int]]:
         return self.persistent_history.get_content()
@@ -286,16 +435,34 @@ class SensorMonitor:
     def __init__(self, sensor: Sensor, history: SensorHistory) -> None:
         self.sensor = sensor
         self.history: SensorHistory = history
-        self.timer: Timer = Timer(-1)
-        self._record_data()
-        self.timer.init(
-            period=SAMPLING_FREQUENCY_SECONDS * 1000,
-            mode=Timer.PERIODIC,
-            callback=self._record_data,
-        )
-
-    def _record_data(self, timer: Timer = None) -> None:
-        self.history.add(self.sensor.data_interface())
+        self.history.name = getattr(sensor, "name", history.sensor_type)
+        self.history.limits = sensor.limits()
+        self.history.render()
+        self.interval_seconds = SAMPLING_FREQUENCY_SECONDS
+
+    async def record(self) -> None:
+        value = await self.read()
+        if value is not None:
+            self.history.add(value)
+
+    async def read(self, max_age_ms: int = 0) -> Optional[float]:
+        return await self.sensor.read_fresh(max_age_ms)
+
+    def next_sample_unix_time(self, now: int) -> int:
+        # continues the schedule of the previous boot, a missing or overdue sample is taken right away
+        content = self.history.get()
+        if not content:
+            return now
+        next_time = content[-1][1] + self.interval_seconds
+        if next_time <= now or next_time - now > self.interval_seconds:
+            # the latter happens when the clock is behind the history, e.g. NTP failed at boot
+            return now
+        return next_time
+
+    def rename(self, name: str) -> None:
+        self.sensor.name = name  # type: ignore
+        self.history.name = name
+        self.history.render()
 
     def get_latest(self) -> Tuple[Any, int]:
         return self.history.get()[-1]
@@ -307,6 +474,61 @@ class SensorMonitor:
         return self.history.get()
 
 
+class SamplingScheduler:
+    # One task samples every sensor. Monitors sharing an interval form one group and one heap
+    # entry, so they are read in the same tick and in config order, sources before derived sensors.
+    # Each monitor keeps its own due time: after a reboot only the members that are due are
+    # sampled, and members that fell out of step all move to the latest pending due time.
+
+    def __init__(self, rtc: WebRealTimeClock) -> None:
+        self.rtc = rtc
+        self.groups: dict[int, list[SensorMonitor]] = {}
+        self.due: dict[SensorMonitor, int] = {}
+        self.queue: list[Tuple[int, int]] = []  # (due unix time, interval)
+
+    def add(self, monitor: SensorMonitor) -> None:
+        self.groups.setdefault(monitor.interval_seconds, []).append(monitor)
+
+    async def run(self) -> None:
+        now = self.rtc.get_current_unix_time()
+        self.queue = []
+        for interval, monitors in self.groups.items():
+            for monitor in monitors:
+                self.due[monitor] = monitor.next_sample_unix_time(now)
+            heappush(self.queue, (min(self.due[monitor] for monitor in monitors), interval))
+        while self.queue:
+            tick, interval = self.queue[0]
+            now = self.rtc.get_current_unix_time()
+            if now < tick and tick - now <= interval:
+                await asyncio.sleep(tick - now)
+                continue
+            heappop(self.queue)
+            monitors = self.groups[interval]
+            sampled = [monitor for monitor in monitors if self.due[monitor] <= tick]
+            for monitor in sampled:
+                try:
+                    await monitor.record()
+                except Exception as e:
+                    print(f"Sampling {monitor.history.name} failed: {e}")
+                await asyncio.sleep(0)
+            pending = [self.due[monitor] for monitor in monitors if self.due[monitor] > tick]
+            # the latest pending due time is the one the whole group can meet at, so a member
+            # out of step takes one shortened interval instead of a sample at every due time
+            next_tick = max(pending) if pending else tick + interval
+            if next_tick <= now or next_tick - now > interval:
+                # missed ticks are skipped rather than sampled in a burst, also after clock corrections
+                next_tick = now + interval
+            for monitor in sampled:
+                self.due[monitor] = next_tick
+            heappush(self.queue, (min(self.due[monitor] for monitor in monitors), interval))
+
+
+DERIVED_SENSOR_TYPES = {
+    "DewPoint": DewPointSensor,
+    "VapourPressureDeficit": VapourPressureDeficitSensor,
+}
+
+
 class Sensors:
     sensor_monitors: dict[str, SensorMonitor] = {}
     sensor_monitors_by_index: list[str] = []
@@ -321,16 +543,44 @@ class Sensors:
             return self.sensor_monitors[uuid]
         raise ValueError("uuid or index must be provided")
 
+    def _aht10(self, configured_sensor: dict[str, Any]) -> AHT10:
+        # temperature and humidity of one chip share a single AHT10 and its cached measurement
+        key = f"{configured_sensor['i2c_bus']}:{configured_sensor['i2c_address']}"
+        if key not in self.aht10_devices:
+            self.aht10_devices[key] = AHT10(
+                i2c_address=configured_sensor["i2c_address"],
+                i2c_bus=configured_sensor["i2c_bus"],
+                i2c_sda_pin=configured_sensor["i2c_sda_pin"],
+                i2c_scl_pin=configured_sensor["i2c_scl_pin"],
+                power_pin=configured_sensor["power_pin"],
+            )
+        return self.aht10_devices[key]
+
+    def add_listener(self, listener: Callable) -> None:
+        # listener(history, value, event_unix_time) is called after every new sample
+        for uuid in self.sensor_monitors_by_index:
+            self.sensor_monitors[uuid].history.listeners.append(listener)
+
     def __init__(self, rtc: WebRealTimeClock) -> None:
         self.rtc = rtc
+        self.aht10_devices: dict[str, AHT10] = {}
+        self.scheduler = SamplingScheduler(rtc=rtc)
         with open("config.json", "r") as f:
             config = load(f)
-        for configured_sensor in config.get("sensors"):
+        for index, configured_sensor in enumerate(config.get("sensors")):
             if not configured_sensor.get("uuid"):
                 configured_sensor.update({"uuid": generate_uuid()})
                 save_config(config)
             sensor_type = configured_sensor.get("type")
+            history = SensorHistory(
+                filename=configured_sensor.get("log_file"),
+                length=HISTORY_LENGTH,
+                rtc=self.rtc,
+                sensor_type=sensor_type,
+                index=index,
+            )
             if sensor_type == "MH-Moisture":
+                history.track_trend(target=configured_sensor.get("min", 0))
                 sensor_monitor = SensorMonitor(
                     MoistureSensor(
                         power_pin=configured_sensor.get("power_pin"),
@@ -340,59 +590,37 @@ class Sensors:
                         name=configured_sensor.get("name"),
                         uuid=configured_sensor.get("uuid"),
                     ),
-                    SensorHistory(
-                        filename=configured_sensor.get("log_file"),
-                        length=HISTORY_LENGTH,
-                        rtc=self.rtc,
-                        sensor_type=sensor_type,
-                    ),
+                    history,
                 )
             elif sensor_type == "AHT10Temperature":
                 sensor_monitor = SensorMonitor(
-                    AHT10TemperatureSensor(
-                        AHT10(
-                            i2c_address=configured_sensor["i2c_address"],
-                            i2c_bus=configured_sensor["i2c_bus"],
-                            i2c_sda_pin=configured_sensor["i2c_sda_pin"],
-                            i2c_scl_pin=configured_sensor["i2c_scl_pin"],
-                            power_pin=configured_sensor["power_pin"],
-                        )
-                    ),
-                    SensorHistory(
-                        filename=configured_sensor.get("log_file"),
-                        length=HISTORY_LENGTH,
-                        rtc=self.rtc,
-                        sensor_type=sensor_type,
-                    ),
+                    AHT10TemperatureSensor(self._aht10(configured_sensor)),
+                    history,
                 )
             elif sensor_type == "AHT10Humidity":
                 sensor_monitor = SensorMonitor(
-                    AHT10HumiditySensor(
-                        AHT10(
-                            i2c_address=configured_sensor["i2c_address"],
-                            i2c_bus=configured_sensor["i2c_bus"],
-                            i2c_sda_pin=configured_sensor["i2c_sda_pin"],
-                            i2c_scl_pin=configured_sensor["i2c_scl_pin"],
-                            power_pin=configured_sensor["power_pin"],
-                        )
-                    ),
-                    SensorHistory(
-                        filename=configured_sensor.get("log_file"),
-                        length=HISTORY_LENGTH,
-                        rtc=self.rtc,
-                        sensor_type=sensor_type,
-                    ),
+                    AHT10HumiditySensor(self._aht10(configured_sensor)),
+                    history,
                 )
             elif sensor_type == "PicoTemperature":
                 sensor_monitor = SensorMonitor(
                     PicoTemperatureSensor(),
-                    SensorHistory(
-                        filename=configured_sensor.get("log_file"),
-                        length=HISTORY_LENGTH,
-                        rtc=self.rtc,
-                        sensor_type=sensor_type,
+                    history,
+                )
+            elif sensor_type in DERIVED_SENSOR_TYPES:
+                # sources must be configured before the derived sensor so they are read first each tick
+                if max(configured_sensor["temperature_index"], configured_sensor["humidity_index"]) >= index:
+                    raise ValueError(f"sources of {sensor_type} must precede it in config.json")
+                sensor_monitor = SensorMonitor(
+                    DERIVED_SENSOR_TYPES[sensor_type](
+                        temperature=self.get_sensor(index=configured_sensor["temperature_index"]).sensor,
+                        humidity=self.get_sensor(index=configured_sensor["humidity_index"]).sensor,
+                        name=configured_sensor.get("name"),
                     ),
+                    history,
                 )
+            sensor_monitor.interval_seconds = configured_sensor.get("sample_interval_seconds", SAMPLING_FREQUENCY_SECONDS)
+            self.scheduler.add(sensor_monitor)
             self.sensor_monitors[configured_sensor.get("uuid")] = sensor_monitor
             self.sensor_monitors_by_index.append(configured_sensor.get("uuid"))
         
@@ -0,0 +1,28 @@
+SPARKLINE_POINTS = 48
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 30
+SPARKLINE_COLOUR = "#2e7d32"
+
+
+def render_sparkline(
+    values: list[float],
+    width: int = SPARKLINE_WIDTH,
+    height: int = SPARKLINE_HEIGHT,
+    colour: str = SPARKLINE_COLOUR,
+) -> str:
+    # Small standalone polyline SVG, embeddable in a plain <img> tag
+    values = values[-SPARKLINE_POINTS:]
+    points = []
+    if values:
+        low = min(values)
+        span = max(values) - low or 1.0
+        step = (width - 2) / max(1, len(values) - 1)
+        for i, value in enumerate(values):
+            x = 1 + i * step
+            y = height - 1 - (value - low) / span * (height - 2)
+            points.append("{:.1f},{:.1f}".format(x, y))
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">'
+        '<polyline fill="none" stroke="{c}" stroke-width="1.5" stroke-linejoin="round" points="{p}"/>'
+        "</svg>"
+    ).format(w=width, h=height, c=colour, p=" ".join(points))
@@ -0,0 +1,76 @@
+from typing import Any, Optional
+
+TREND_HALF_LIFE_HOURS = 24
+MIN_TREND_SAMPLES = 3
+
+
+class TrendModel:
+    # Exponentially weighted least squares fit of value over time, updated in O(1) per sample.
+    # Time is measured in hours relative to the newest sample: the weighted sums are shifted to
+    # the new origin on every update, which keeps them small enough for single precision floats.
+
+    def __init__(self, target: float, half_life_hours: float = TREND_HALF_LIFE_HOURS) -> None:
+        self.target = target
+        self.half_life_hours = half_life_hours
+        self.last_unix_time: Optional[int] = None
+        self.samples = 0
+        self.sum_w = 0.0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+
+    def add(self, value: float, event_unix_time: int) -> None:
+        if self.last_unix_time is not None:
+            if event_unix_time < self.last_unix_time:
+                return
+            shift = (event_unix_time - self.last_unix_time) / 3600
+            decay = 0.5 ** (shift / self.half_life_hours)
+            # move the origin to the new sample (x -> x - shift), then age the old samples
+            self.sum_xx = (self.sum_xx - 2 * shift * self.sum_x + shift * shift * self.sum_w) * decay
+            self.sum_xy = (self.sum_xy - shift * self.sum_y) * decay
+            self.sum_x = (self.sum_x - shift * self.sum_w) * decay
+            self.sum_y *= decay
+            self.sum_w *= decay
+        # the new sample sits at x = 0, so it only adds to the weight and value sums
+        self.sum_w += 1
+        self.sum_y += value
+        self.last_unix_time = event_unix_time
+        self.samples += 1
+
+    def slope(self) -> Optional[float]:
+        # change per hour
+        denominator = self.sum_w * self.sum_xx - self.sum_x * self.sum_x
+        if self.samples < MIN_TREND_SAMPLES or denominator <= 1e-9:
+            return None
+        return (self.sum_w * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+    def level(self) -> Optional[float]:
+        # fitted value at the newest sample
+        slope = self.slope()
+        if slope is None:
+            return None
+        return (self.sum_y - slope * self.sum_x) / self.sum_w
+
+    def hours_to_target(self) -> Optional[float]:
+        slope = self.slope()
+        level = self.level()
+        if slope is None or level is None:
+            return None
+        if level <= self.target:
+            return 0.0
+        if slope >= 0:
+            return None
+        return (self.target - level) / slope
+
+    def to_dict(self) -> dict[str, Any]:
+        slope = self.slope()
+        level = self.level()
+        hours = self.hours_to_target()
+        return {
+            "slope_per_hour": None if slope is None else round(slope, 3),
+            "level": None if level is None else round(level, 1),
+            "min": self.target,
+            "hours_to_min": None if hours is None else round(hours, 1),
+            "min_reached_at": None if hours is None else int(self.last_unix_time + hours * 3600),  # type: ignore
+        }
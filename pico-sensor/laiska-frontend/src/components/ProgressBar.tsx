@@ -4,39 +4,43 @@ import { useState, useEffect } from 'react';
 interface ProgressBarProps {
   duration: number; // duration is in seconds
   description: string;
+  progress?: number; // known progress in percent, replaces the timed estimate
 }
 
 function reloadWrapper() {
     window.location.reload()
 }
 
-export default function ProgressBar({ duration: duration, description: description }: ProgressBarProps) {
+export default function ProgressBar({ duration: duration, description: description, progress: knownProgress }: ProgressBarProps) {
   const [progress, setProgress] = useState<number>(0);
+  const controlled = knownProgress !== undefined;
 
   useEffect(() => {
-    if (progress < 100) {
+    if (!controlled && progress < 100) {
       const interval = setInterval(() => {
         setProgress((prev) => Math.min(prev + 100 / duration, 100));
       }, 1000); // update every second
 
       return () => clearInterval(interval);
     }
-  }, [progress, duration]);
+  }, [progress, duration, controlled]);
 
   
 
-  if (progress == 100) {
+  if (!controlled && progress == 100) {
     setTimeout(reloadWrapper, 1000);
   }
 
+  const shownProgress = controlled ? Math.min(Math.max(knownProgress, 0), 100) : progress;
+
   return (
     <div className="progress-bar-container">
       <div>{description}</div>
       <div
         className="progress-bar"
-        style={{ width: `${progress}%` }}
+        style={{ width: `${shownProgress}%` }}
       >
-        {Math.floor(progress)}%
+        {Math.floor(shownProgress)}%
       </div>
     </div>
   );
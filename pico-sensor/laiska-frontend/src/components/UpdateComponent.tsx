@@ -3,6 +3,26 @@ import axios from "axios";
 import { API_URL } from "../config";
 import ProgressBar from "./ProgressBar";
 
+interface UpdateStatus {
+  state: string;
+  error: string | null;
+  file: number;
+  files: number;
+  fileName: string | null;
+  fileBytes: number;
+  fileBytesTotal: number;
+  bytesDownloaded: number;
+}
+
+const UPDATE_POLL_INTERVAL_MS = 1000;
+
+function downloadProgress(status: UpdateStatus): number {
+  if (!status.files) {
+    return 0;
+  }
+  const fileFraction = status.fileBytesTotal ? status.fileBytes / status.fileBytesTotal : 0;
+  return ((status.file - 1 + fileFraction) / status.files) * 100;
+}
 
 export default function UpdateComponent() {
   const [updatesAvailable, setUpdatesAvailable] = useState<boolean>(false);
@@ -12,6 +32,7 @@ export default function UpdateComponent() {
   const [loading, setLoading] = useState<boolean>(true);
   const [downloading, setDownloading] = useState<boolean>(false);
   const [installing, setInstalling] = useState<boolean>(false);
+  const [updateStatus, setUpdateStatus] = useState<UpdateStatus | null>(null);
 
   const handleReload = () => {
     window.location.reload();
@@ -20,18 +41,37 @@ export default function UpdateComponent() {
   const handleDownload = async() => {
     try {
       setDownloading(true);
+      // the pico downloads in the background, progress is polled until the job ends
       const response = await axios.post(
-        API_URL + "/api/v1/download_firmware"
+        API_URL + "/api/v1/download_firmware?background=1"
       )
+      let status: UpdateStatus = response.data
+      setUpdateStatus(status)
+      while (["queued", "downloading", "verifying"].includes(status.state)) {
+        await new Promise((resolve) => setTimeout(resolve, UPDATE_POLL_INTERVAL_MS));
+        status = (await axios.get(API_URL + "/api/v1/update_status")).data
+        setUpdateStatus(status)
+      }
       setDownloading(false)
-      console.log("response", response.data)
-      setDownloadOk(response.data.ready)
+      console.log("update status", status)
+      if (status.error) {
+        console.error("Error downloading update:", status.error);
+      }
+      setDownloadOk(status.state === "ready")
     } catch (error) {
       console.error("Error initiating cloud update:", error);
       setDownloading(false)
     }
   };
 
+  const handleCancel = async() => {
+    try {
+      await axios.post(API_URL + "/api/v1/cancel_update")
+    } catch (error) {
+      console.error("Error cancelling update:", error);
+    }
+  };
+
   const handleInstall = async() => {
     try {
       setInstalling(true)
@@ -98,7 +138,16 @@ export default function UpdateComponent() {
         <div>Available version: {String(remoteVersion)}</div>
         {updatesAvailable && !downloading && !downloadOk && (<button onClick={handleDownload}>Download</button>)}
         {downloadOk && !installing && (<button onClick={handleInstall}>Install</button>)}
-        {downloading && (<ProgressBar duration={60} description="downloading.."/>)}
+        {downloading && (
+          <ProgressBar
+            duration={60}
+            description={updateStatus?.state === "downloading" && updateStatus.files
+              ? `downloading ${updateStatus.file}/${updateStatus.files}..`
+              : `${updateStatus?.state ?? "starting"}..`}
+            progress={updateStatus ? downloadProgress(updateStatus) : 0}
+          />
+        )}
+        {downloading && (<button onClick={handleCancel}>Cancel</button>)}
         {installing && (<ProgressBar duration={60} description="installing.."/>)}
     </div>
   );
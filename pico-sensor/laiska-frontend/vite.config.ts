@@ -2,13 +2,21 @@ import { defineConfig } from 'vite';
 import react from '@vitejs/plugin-react';
 import compression from 'vite-plugin-compression';
 
+// The pico serves the best precompressed variant the browser accepts. Both
+// variants are built from the original file, so neither step deletes it;
+// only the files listed in version.json are copied to the pico.
 export default defineConfig({
   plugins: [
     react(),
+    compression({
+      algorithm: 'brotliCompress',
+      ext: '.br',
+      deleteOriginFile: false,
+    }),
     compression({
       algorithm: 'gzip',
       ext: '.gz',
-      deleteOriginFile: true,
+      deleteOriginFile: false,
     }),
   ],
 });
@@ -0,0 +1,82 @@
+# Host benchmark for sync route handlers run inline vs in the thread pool executor.
+# Serves requests through the firmware's microdot over in-memory streams under CPython:
+#   python tools/bench_inline_handlers.py [requests]
+
+import asyncio
+import io
+import sys
+import time
+from os import path
+
+# the components directory is added directly, the pico-sensor root holds a typing shim
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "pico-sensor", "components"))
+from microdot import Microdot  # noqa: E402
+
+BATCH = 300
+
+
+class Reader:
+    def __init__(self, data: bytes) -> None:
+        self.stream = io.BytesIO(data)
+
+    async def readline(self) -> bytes:
+        return self.stream.readline()
+
+    async def read(self, n: int = -1) -> bytes:
+        return self.stream.read(n)
+
+    async def readexactly(self, n: int) -> bytes:
+        return self.stream.read(n)
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.out = b""
+
+    async def awrite(self, data: bytes) -> None:
+        self.out += bytes(data)
+
+    async def aclose(self) -> None:
+        pass
+
+    def get_extra_info(self, name: str) -> tuple:
+        return ("127.0.0.1", 1234)
+
+
+def make_app(mode: str) -> Microdot:
+    app = Microdot()
+    app.max_concurrent_requests = BATCH
+    app.max_queued_requests = BATCH
+    if mode == "inline_sync_handlers":
+        app.inline_sync_handlers = True
+
+    @app.route("/api/v1/health", inline=(mode == "route inline=True"))
+    def get_health(request):
+        return '{"ok": true}', 200
+
+    return app
+
+
+async def serve(app: Microdot, requests: int) -> float:
+    async def one() -> bool:
+        writer = Writer()
+        await app.handle_request(Reader(b"GET /api/v1/health HTTP/1.0\r\n\r\n"), writer)
+        return writer.out.startswith(b"HTTP/1.1 200")
+
+    started = time.perf_counter()
+    for _ in range(requests // BATCH):
+        if not all(await asyncio.gather(*[one() for _ in range(BATCH)])):
+            raise RuntimeError("a request failed")
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    requests = max(BATCH, requests - requests % BATCH)
+    for mode in ("executor", "route inline=True", "inline_sync_handlers"):
+        elapsed = asyncio.run(serve(make_app(mode), requests))
+        print(f"{mode:>22}: {requests / elapsed:8.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
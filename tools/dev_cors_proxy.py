@@ -36,6 +36,29 @@ def proxy_sensor_data():
     ).json()
 
 
+@app.route("/api/v1/alerts", methods=["GET"])
+def proxy_alerts():
+    return get(f"{sensor_url}/api/v1/alerts").json()
+
+
+@app.route("/api/v1/read_now", methods=["GET"])
+def proxy_read_now():
+    sensor_index = request.args.get("sensor_index")
+    return get(f"{sensor_url}/api/v1/read_now?sensor_index={sensor_index}").json()
+
+
+@app.route("/api/v1/sparkline.svg", methods=["GET"])
+def proxy_sparkline():
+    sensor_index = request.args.get("sensor_index")
+    response = get(f"{sensor_url}/api/v1/sparkline.svg?sensor_index={sensor_index}")
+    return response.content, response.status_code, {"Content-Type": "image/svg+xml"}
+
+
+@app.route("/api/v1/forecast", methods=["GET"])
+def proxy_forecast():
+    return get(f"{sensor_url}/api/v1/forecast").json()
+
+
 @app.route("/api/v1/led", methods=["POST"])
 def proxy_led():
     data = request.json
@@ -60,7 +83,19 @@ def get_updates_available():
 
 @app.route("/api/v1/download_firmware", methods=["POST"])
 def post_update_firmware():
-    return post(f"{sensor_url}/api/v1/download_firmware").json()
+    response = post(f"{sensor_url}/api/v1/download_firmware", params=request.args)
+    return response.json(), response.status_code
+
+
+@app.route("/api/v1/update_status", methods=["GET"])
+def proxy_update_status():
+    return get(f"{sensor_url}/api/v1/update_status").json()
+
+
+@app.route("/api/v1/cancel_update", methods=["POST"])
+def post_cancel_update():
+    response = post(f"{sensor_url}/api/v1/cancel_update")
+    return response.json(), response.status_code
 
 
 @app.route("/api/v1/reset", methods=["POST"])